@@ -0,0 +1,175 @@
+"""coordinate-sorted, block-compressed alignment store with a region index
+
+The store holds the alignment lines of a SAM file sorted by (chromosome,
+position), packed into zlib-compressed blocks of about BLOCK_SIZE bytes. For each
+chromosome, the index records the position range and file offset of every block
+(like the linear index of BAI/CSI files), so a region query only decompresses
+the few blocks overlapping the region.
+
+File layout:
+    MAGIC
+    compressed blocks
+    index (zlib-compressed JSON)
+    8-byte little-endian offset of the index
+
+usage: python3 scripts/alignment_store.py <in.sam> <out.store>
+"""
+
+import heapq
+import json
+import os
+import struct
+import sys
+import tempfile
+import zlib
+from bisect import bisect_left
+from typing import Dict, Iterator, List, Tuple
+
+from atomic import atomic_write
+from profiling import profile_script
+from sam import POS, RNAME, read_sam_lines, split_fields
+
+MAGIC = b"SXAS\x01"
+
+# uncompressed size of a block (in bytes)
+BLOCK_SIZE = 1 << 16
+
+# uncompressed size of a sorted run written to disk during the build (in bytes)
+RUN_SIZE = 1 << 28
+
+FOOTER = struct.Struct("<Q")
+
+
+def _sort_key(line: str) -> Tuple[str, int]:
+    chrom, pos = split_fields(line, (RNAME, POS))
+    return chrom, int(pos)
+
+
+def _write_runs(sam_path: str, tmp_dir: str) -> List[str]:
+    """Split the mapped alignments into sorted runs of about RUN_SIZE bytes each."""
+    run_paths = []
+    run: List[str] = []
+    run_size = 0
+
+    def flush():
+        run.sort(key=_sort_key)
+        run_path = os.path.join(tmp_dir, f"run_{len(run_paths)}.sam")
+        with open(run_path, "w") as run_file:
+            run_file.writelines(run)
+        run_paths.append(run_path)
+        run.clear()
+
+    for line in read_sam_lines(sam_path):
+        # unmapped reads cannot be found by a region query
+        if split_fields(line, (RNAME,))[0] == "*":
+            continue
+        run.append(line)
+        run_size += len(line)
+        if run_size >= RUN_SIZE:
+            flush()
+            run_size = 0
+    if run:
+        flush()
+    return run_paths
+
+
+def build_store(sam_path: str, store_path: str):
+    """Sort the alignments of a SAM file into a new indexed store."""
+    # blocks for each chromosome: [first pos, last pos, offset, compressed length]
+    index: Dict[str, List[List[int]]] = {}
+
+    with tempfile.TemporaryDirectory(
+        dir=os.path.dirname(os.path.abspath(store_path))
+    ) as tmp_dir, atomic_write(store_path, "wb") as out_file:
+        run_files = [open(run_path, "r") for run_path in _write_runs(sam_path, tmp_dir)]
+        out_file.write(MAGIC)
+
+        block: List[str] = []
+        block_size = 0
+        block_chrom = None
+        block_first = block_last = 0
+
+        def flush():
+            data = zlib.compress("".join(block).encode())
+            index.setdefault(block_chrom, []).append(
+                [block_first, block_last, out_file.tell(), len(data)]
+            )
+            out_file.write(data)
+            block.clear()
+
+        try:
+            for line in heapq.merge(*run_files, key=_sort_key):
+                chrom, pos = _sort_key(line)
+                # blocks never span two chromosomes
+                if block and (chrom != block_chrom or block_size >= BLOCK_SIZE):
+                    flush()
+                if not block:
+                    block_chrom = chrom
+                    block_first = pos
+                    block_size = 0
+                block.append(line)
+                block_size += len(line)
+                block_last = pos
+            if block:
+                flush()
+        finally:
+            for run_file in run_files:
+                run_file.close()
+
+        index_offset = out_file.tell()
+        out_file.write(zlib.compress(json.dumps(index).encode()))
+        out_file.write(FOOTER.pack(index_offset))
+
+
+class AlignmentStore:
+    """Read-only access to a store written by build_store."""
+
+    def __init__(self, path: str):
+        self._file = open(path, "rb")
+        if self._file.read(len(MAGIC)) != MAGIC:
+            self._file.close()
+            raise ValueError(f"{path} is not an alignment store")
+        self._file.seek(-FOOTER.size, os.SEEK_END)
+        footer_offset = self._file.tell()
+        (index_offset,) = FOOTER.unpack(self._file.read(FOOTER.size))
+        self._file.seek(index_offset)
+        self._index: Dict[str, List[List[int]]] = json.loads(
+            zlib.decompress(self._file.read(footer_offset - index_offset))
+        )
+        # last position of each block, for binary search
+        self._block_ends = {
+            chrom: [block[1] for block in blocks]
+            for chrom, blocks in self._index.items()
+        }
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_):
+        self.close()
+
+    def close(self):
+        self._file.close()
+
+    def fetch(self, chrom: str, start: int, end: int) -> Iterator[str]:
+        """Yield the alignment lines on chrom with start <= POS <= end, in position order."""
+        blocks = self._index.get(chrom)
+        if blocks is None:
+            return
+        for block in blocks[bisect_left(self._block_ends[chrom], start) :]:
+            first, _, offset, length = block
+            if first > end:
+                break
+            self._file.seek(offset)
+            lines = zlib.decompress(self._file.read(length)).decode()
+            for line in lines.splitlines(keepends=True):
+                pos = int(split_fields(line, (POS,))[0])
+                if pos > end:
+                    return
+                if pos >= start:
+                    yield line
+
+
+if __name__ == "__main__":
+    profile_script()
+    build_store(sys.argv[1], sys.argv[2])
@@ -0,0 +1,28 @@
+"""writing output files atomically
+
+The output is written to a temporary file next to it, which is only renamed to
+the output path once it is complete. Readers running at the same time (e.g.
+other worker processes) never see a partial file, and an interrupted build
+never leaves one behind for make to take as up to date.
+"""
+
+import os
+from contextlib import contextmanager
+from typing import IO, Iterator
+
+
+@contextmanager
+def atomic_write(path: str, mode: str = "w") -> Iterator[IO]:
+    """Open a file to write path with, moved into place if the body succeeds.
+
+    If the body fails, the temporary file is removed and path is left as it was.
+    """
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    try:
+        with open(tmp_path, mode) as out_file:
+            yield out_file
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
@@ -0,0 +1,404 @@
+"""benchmarks of the core of the extraction and table scripts, on synthetic data
+
+The generators write a te_mapper_output.json and a te_mapper genome_aligned.sam
+at a chosen scale (reads, targets, chromosomes, share of clipped reads); each
+benchmark then times one core step of the scripts on that data:
+
+    json_load: parsing te_mapper_output.json (no cache)
+    candidate_matching: finding the call of every target (filter_results)
+    cigar_parsing: parsing every CIGAR string (with an empty cache)
+    split_read_parsing: scanning the SAM file into split reads
+    csv_writing: writing the split read sequence table rows
+    figure_rendering: drawing the split reads of the calls (PNG)
+
+Every run is appended to a JSON lines history together with the commit and the
+scale, and compared to the last run at the same scale: a benchmark more than
+--threshold times slower than before is reported as a regression (and the exit
+status is 1).
+
+usage:
+    python3 scripts/benchmark.py run [--reads N] [--targets N] [--history PATH]
+    python3 scripts/benchmark.py generate [--reads N] [--targets N] OUT_DIR
+"""
+
+import argparse
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+from dataclasses import asdict, dataclass
+from typing import Callable, Dict, List, Optional, Tuple
+
+from cigar import parse_cigar
+from diagrams import insertion_diagram, save
+from make_split_read_sequence_table import (
+    SPLIT_READ_COLUMNS,
+    Row,
+    columns,
+    filter_results,
+    parse_split_read,
+    row_values,
+)
+from results import Result, load_results
+from sam import CIGAR, read_sam
+from tables import open_table
+from target_registry import Target, TargetRegistry
+
+HISTORY_PATH = "output/benchmark/history.jsonl"
+
+TE_NAMES = [
+    "1360#DNA/P",
+    "copia#LTR/Copia",
+    "HMS-Beagle#LTR/Gypsy",
+    "hobo#DNA/hAT",
+    "roo#LTR/Bel-Pao",
+    "invader1#LTR/Gypsy",
+]
+
+READ_LENGTH = 150
+
+# decoy calls are kept at least this far from the targets of their TE family
+DECOY_DISTANCE = 10_000
+
+
+@dataclass
+class Scale:
+    # alignments in the SAM file
+    reads: int = 200_000
+    targets: int = 200
+    chromosomes: int = 5
+    chromosome_length: int = 25_000_000
+    # split reads on each side of a target's call
+    reads_per_call: int = 50
+    # calls that are not near any target
+    decoys: int = 2_000
+    # share of the alignments that are clipped, and of those near a target
+    clip_rate: float = 0.9
+    near_rate: float = 0.4
+    seed: int = 1
+
+
+def chromosome_names(scale: Scale) -> List[str]:
+    return [f"chr{i + 1}" for i in range(scale.chromosomes)]
+
+
+def synthetic_targets(scale: Scale) -> TargetRegistry:
+    rng = random.Random(scale.seed)
+    chroms = chromosome_names(scale)
+    return TargetRegistry(
+        [
+            Target(
+                f"T{i}",
+                rng.choice(TE_NAMES),
+                rng.choice(chroms),
+                # targets are spread out, so each has at most one call nearby
+                (i + 1) * (scale.chromosome_length // (scale.targets + 1)),
+                groups=("benchmark",),
+            )
+            for i in range(scale.targets)
+        ]
+    )
+
+
+def _split_reads(rng: random.Random, count: int, upstream: bool) -> List[dict]:
+    reads = []
+    for _ in range(count):
+        genome = rng.randint(20, READ_LENGTH - 20)
+        if upstream:
+            reads.append(
+                {"te_range": [genome + 1, READ_LENGTH], "genome_range": [1, genome]}
+            )
+        else:
+            te = READ_LENGTH - genome
+            reads.append({"te_range": [1, te], "genome_range": [te + 1, READ_LENGTH]})
+    return reads
+
+
+def write_results_json(path: str, scale: Scale, targets: TargetRegistry):
+    """A te_mapper_output.json with a call at every target, and decoy calls."""
+    rng = random.Random(scale.seed + 1)
+    calls: Dict[str, List[dict]] = {chrom: [] for chrom in chromosome_names(scale)}
+
+    def call(te_name: str, chrom: str, pos: int) -> dict:
+        return {
+            "name": te_name,
+            "chrom": chrom,
+            "upstream_pos": pos,
+            "downstream_pos": pos + rng.randint(-10, 10),
+            "orientation": rng.choice(["PlusPlus", "PlusMinus"]),
+            "upstream_reads": _split_reads(rng, scale.reads_per_call, True),
+            "downstream_reads": _split_reads(rng, scale.reads_per_call, False),
+        }
+
+    for tgt in targets:
+        calls[tgt.chrom].append(call(tgt.te_name, tgt.chrom, tgt.pos))
+    for _ in range(scale.decoys):
+        te_name = rng.choice(TE_NAMES)
+        chrom = rng.choice(list(calls))
+        pos = rng.randint(1, scale.chromosome_length)
+        if any(
+            tgt.chrom == chrom
+            and tgt.te_name.split("#")[0] == te_name.split("#")[0]
+            and abs(tgt.pos - pos) < DECOY_DISTANCE
+            for tgt in targets
+        ):
+            continue
+        decoy = call(te_name, chrom, pos)
+        # decoys have few reads, like most background calls
+        decoy["upstream_reads"] = decoy["upstream_reads"][:2]
+        decoy["downstream_reads"] = decoy["downstream_reads"][:2]
+        calls[chrom].append(decoy)
+
+    with open(path, "w") as out_file:
+        json.dump(
+            [
+                {"non_reference": chrom_calls, "reference": []}
+                for chrom_calls in calls.values()
+            ],
+            out_file,
+        )
+
+
+def write_sam(path: str, scale: Scale, targets: TargetRegistry):
+    """A te_mapper genome_aligned.sam: split reads near the targets, and background."""
+    rng = random.Random(scale.seed + 2)
+    chroms = chromosome_names(scale)
+    target_list = list(targets)
+    with open(path, "w") as out_file:
+        for chrom in chroms:
+            out_file.write(f"@SQ\tSN:{chrom}\tLN:{scale.chromosome_length}\n")
+        for i in range(scale.reads):
+            if target_list and rng.random() < scale.near_rate:
+                tgt = rng.choice(target_list)
+                te_name, chrom = tgt.te_name, tgt.chrom
+                pos = max(tgt.pos + rng.randint(-500, 500), 1)
+            else:
+                te_name, chrom = rng.choice(TE_NAMES), rng.choice(chroms)
+                pos = rng.randint(1, scale.chromosome_length)
+            genome = rng.randint(20, READ_LENGTH - 20)
+            te = READ_LENGTH - genome
+            clip = rng.choice("SH")
+            if rng.random() >= scale.clip_rate:
+                cigar = f"{READ_LENGTH}M"
+            elif rng.random() < 0.5:
+                cigar = f"{genome}M{te}{clip}"
+            else:
+                cigar = f"{te}{clip}{genome}M"
+            seq = "".join(rng.choices("ACGT", k=READ_LENGTH))
+            out_file.write(
+                f"read:{i}|{te_name}|{te}|{genome}|SM|start\t0\t{chrom}\t{pos}\t0\t"
+                f"{cigar}\t*\t0\t0\t{seq}\t*\tNM:i:0\n"
+            )
+
+
+def generate(out_dir: str, scale: Scale) -> Tuple[str, str, TargetRegistry]:
+    """Write the synthetic data to a folder; (JSON path, SAM path, targets)."""
+    os.makedirs(out_dir, exist_ok=True)
+    targets = synthetic_targets(scale)
+    json_path = os.path.join(out_dir, "te_mapper_output.json")
+    sam_path = os.path.join(out_dir, "genome_aligned.sam")
+    write_results_json(json_path, scale, targets)
+    write_sam(sam_path, scale, targets)
+    return json_path, sam_path, targets
+
+
+def timed(function: Callable[[], int], repeat: int) -> Tuple[float, int]:
+    """Best time of a few runs of a function, and the records it processed."""
+    best = float("inf")
+    records = 0
+    for _ in range(repeat):
+        start = time.perf_counter()
+        records = function()
+        best = min(best, time.perf_counter() - start)
+    return best, records
+
+
+def benchmarks(
+    json_path: str, sam_path: str, targets: TargetRegistry, out_dir: str
+) -> Dict[str, Callable[[], int]]:
+    """The benchmarks, each returning the number of records it processed."""
+    results = load_results(json_path, use_cache=False)
+    reads = [
+        read
+        for read in (
+            parse_split_read(*fields)
+            for fields in read_sam(sam_path, SPLIT_READ_COLUMNS)
+        )
+        if read is not None
+    ]
+    cigars = [cigar for (cigar,) in read_sam(sam_path, (CIGAR,))]
+    found: List[Result] = [result for _, result in filter_results(results, targets)]
+
+    def json_load() -> int:
+        return len(load_results(json_path, use_cache=False))
+
+    def candidate_matching() -> int:
+        filter_results(results, targets)
+        return len(targets)
+
+    def cigar_parsing() -> int:
+        parse_cigar.cache_clear()
+        for cigar in cigars:
+            parse_cigar(cigar)
+        return len(cigars)
+
+    def split_read_parsing() -> int:
+        return sum(
+            parse_split_read(*fields) is not None
+            for fields in read_sam(sam_path, SPLIT_READ_COLUMNS)
+        )
+
+    def csv_writing() -> int:
+        with open_table(os.path.join(out_dir, "table.csv"), columns()) as table:
+            for read in reads:
+                row = Row(
+                    "benchmark.fastq",
+                    "T",
+                    read.te_name,
+                    read.sequence,
+                    read.upstream,
+                    read=read,
+                )
+                table.write(row_values(row))
+        return len(reads)
+
+    def figure_rendering() -> int:
+        for i, result in enumerate(found[:20]):
+            diagram = insertion_diagram(
+                1_000, result.upstream_reads, result.downstream_reads
+            )
+            save(diagram, os.path.join(out_dir, f"figure_{i}.png"))
+        return min(len(found), 20)
+
+    return {
+        "json_load": json_load,
+        "candidate_matching": candidate_matching,
+        "cigar_parsing": cigar_parsing,
+        "split_read_parsing": split_read_parsing,
+        "csv_writing": csv_writing,
+        "figure_rendering": figure_rendering,
+    }
+
+
+def current_commit() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def last_run(history_path: str, scale: Scale) -> Optional[dict]:
+    """The last run in the history at the same scale (None if there is none)."""
+    if not os.path.exists(history_path):
+        return None
+    last = None
+    with open(history_path, "r") as in_file:
+        for line in in_file:
+            run = json.loads(line)
+            if run["scale"] == asdict(scale):
+                last = run
+    return last
+
+
+def run(scale: Scale, history_path: str, repeat: int, threshold: float) -> bool:
+    """Run the benchmarks and record them; False if any of them regressed."""
+    with tempfile.TemporaryDirectory() as data_dir:
+        json_path, sam_path, targets = generate(data_dir, scale)
+        timings = {}
+        for name, function in benchmarks(
+            json_path, sam_path, targets, data_dir
+        ).items():
+            seconds, records = timed(function, repeat)
+            timings[name] = {"seconds": round(seconds, 6), "records": records}
+
+    previous = last_run(history_path, scale)
+    regressed = []
+    print(f"{'benchmark':<22}{'seconds':>10}{'records/s':>14}{'vs last':>10}")
+    for name, timing in timings.items():
+        rate = timing["records"] / timing["seconds"] if timing["seconds"] else 0
+        change = ""
+        if previous is not None and name in previous["timings"]:
+            ratio = timing["seconds"] / previous["timings"][name]["seconds"]
+            change = f"{ratio:.2f}x"
+            if ratio > threshold:
+                regressed.append(name)
+        print(f"{name:<22}{timing['seconds']:>10.3f}{rate:>14.0f}{change:>10}")
+
+    os.makedirs(os.path.dirname(os.path.abspath(history_path)), exist_ok=True)
+    with open(history_path, "a") as out_file:
+        out_file.write(
+            json.dumps(
+                {
+                    "time": round(time.time(), 3),
+                    "commit": current_commit(),
+                    "python": sys.version.split()[0],
+                    "scale": asdict(scale),
+                    "timings": timings,
+                }
+            )
+            + "\n"
+        )
+
+    if regressed:
+        print(
+            f"slower than the last run ({previous['commit']}) by more than "
+            f"{threshold}x: {', '.join(regressed)}"
+        )
+    return not regressed
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="benchmark the extraction and table scripts on synthetic data"
+    )
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    run_parser = subparsers.add_parser("run", help="run and record the benchmarks")
+    generate_parser = subparsers.add_parser(
+        "generate", help="only write the synthetic data"
+    )
+    generate_parser.add_argument("out_dir", help="folder for the synthetic data")
+
+    defaults = Scale()
+    for subparser in (run_parser, generate_parser):
+        for field, default in asdict(defaults).items():
+            subparser.add_argument(
+                f"--{field.replace('_', '-')}",
+                type=type(default),
+                default=default,
+                help=f"(default: {default})",
+            )
+    run_parser.add_argument(
+        "--repeat", type=int, default=3, help="runs of each benchmark (best is kept)"
+    )
+    run_parser.add_argument(
+        "--history",
+        default=HISTORY_PATH,
+        help=f"JSON lines file the runs are appended to (default: {HISTORY_PATH})",
+    )
+    run_parser.add_argument(
+        "--threshold",
+        type=float,
+        default=1.25,
+        help="slowdown relative to the last run that counts as a regression",
+    )
+    args = parser.parse_args()
+    scale = Scale(**{field: getattr(args, field) for field in asdict(defaults)})
+
+    if args.command == "generate":
+        generate(args.out_dir, scale)
+        return
+    if not run(scale, args.history, args.repeat, args.threshold):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,221 @@
+"""calculate various statistics for the Stan-X paper (Python port of calculate_stats)
+
+usage: python3 scripts/calculate_stats.py fast_coverage -q READS -r REF -o OUT
+
+The output matches `cargo run --bin calculate_stats -- fast_coverage`. Paths can
+be "-" for standard input / output, and gzip or BGZF inputs are decompressed.
+
+An uncompressed FASTQ file is memory-mapped and split into one byte range per
+worker process, each starting at a record boundary; the workers count the
+sequence bases of their range block by block with numpy. Compressed input and
+standard input have to be decompressed in order, so they are counted in a
+single stream with the same block counter (BGZF blocks are inflated by a
+thread pool, see compressed.py).
+"""
+
+import argparse
+import mmap
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Tuple
+
+import numpy as np
+
+from compressed import is_compressed, open_input, resolve
+from profiling import profile_script
+
+# bytes counted at once
+BLOCK_SIZE = 1 << 24
+
+NEWLINE = ord("\n")
+
+
+class FastqCounter:
+    """Sequence bases of the FASTQ records fed to it, in blocks of any size.
+
+    The FASTQ has to be in the usual 4-line format, and the first block has to
+    start at the start of a record.
+    """
+
+    def __init__(self):
+        self.bases = 0
+        # line of the current record (0: header, 1: sequence, 2: "+", 3: quality)
+        self._line = 0
+        # bytes of the current line seen in previous blocks
+        self._partial = 0
+
+    def feed(self, block: np.ndarray):
+        newlines = np.flatnonzero(block == NEWLINE)
+        if not len(newlines):
+            self._partial += len(block)
+            return
+        lengths = np.diff(newlines, prepend=-1) - 1
+        lengths[0] += self._partial
+        # sequence lines are at line 1 of a record
+        first = (1 - self._line) % 4
+        self.bases += int(lengths[first::4].sum())
+        self._line = (self._line + len(newlines)) % 4
+        self._partial = len(block) - int(newlines[-1]) - 1
+
+    def finish(self) -> int:
+        # the last line may not end with a newline
+        if self._line == 1:
+            self.bases += self._partial
+        self._line, self._partial = 0, 0
+        return self.bases
+
+
+def _is_record_start(data: mmap.mmap, pos: int) -> bool:
+    """Does a FASTQ record start at pos (which is at the start of a line)?"""
+    # a quality line can start with "@" too, but then the line two lines down is a
+    # sequence line, which can never start with "+"
+    if data[pos : pos + 1] != b"@":
+        return False
+    header_end = data.find(b"\n", pos)
+    sequence_end = data.find(b"\n", header_end + 1) if header_end != -1 else -1
+    return sequence_end != -1 and data[sequence_end + 1 : sequence_end + 2] == b"+"
+
+
+def record_boundary(data: mmap.mmap, pos: int) -> int:
+    """Start of the first FASTQ record at or after pos (len(data) if none)."""
+    if pos > 0:
+        newline = data.find(b"\n", pos - 1)
+        pos = len(data) if newline == -1 else newline + 1
+    while pos < len(data) and not _is_record_start(data, pos):
+        newline = data.find(b"\n", pos)
+        pos = len(data) if newline == -1 else newline + 1
+    return pos
+
+
+def _count_fastq_range(job: Tuple[str, int, int]) -> int:
+    path, start, end = job
+    counter = FastqCounter()
+    with open(path, "rb") as in_file:
+        data = mmap.mmap(in_file.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            for block_start in range(start, end, BLOCK_SIZE):
+                block_end = min(block_start + BLOCK_SIZE, end)
+                block = np.frombuffer(
+                    data,
+                    dtype=np.uint8,
+                    count=block_end - block_start,
+                    offset=block_start,
+                )
+                counter.feed(block)
+                # the block is a view of the mapping, which cannot be closed while in use
+                del block
+        finally:
+            data.close()
+    return counter.finish()
+
+
+def count_fastq_bases(path: str, jobs: int) -> int:
+    """Number of sequence bases in a FASTQ file."""
+    path = resolve(path)
+    if path == "-" or is_compressed(path) or os.path.getsize(path) == 0:
+        counter = FastqCounter()
+        with open_input(path, threads=jobs) as in_file:
+            for chunk in iter(lambda: in_file.read(BLOCK_SIZE), b""):
+                counter.feed(np.frombuffer(chunk, dtype=np.uint8))
+        return counter.finish()
+
+    with open(path, "rb") as in_file:
+        data = mmap.mmap(in_file.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            size = len(data)
+            bounds = sorted(
+                {record_boundary(data, size * i // jobs) for i in range(jobs)} | {size}
+            )
+        finally:
+            data.close()
+    ranges: List[Tuple[str, int, int]] = [
+        (path, start, end) for start, end in zip(bounds, bounds[1:])
+    ]
+    if len(ranges) > 1:
+        with ProcessPoolExecutor(max_workers=len(ranges)) as pool:
+            return sum(pool.map(_count_fastq_range, ranges))
+    return sum(map(_count_fastq_range, ranges))
+
+
+def count_fasta_bases(path: str) -> int:
+    """Number of sequence bases in a (multi-line) FASTA file."""
+    bases = 0
+    with open_input(path) as in_file:
+        for line in in_file:
+            if not line.startswith(b">"):
+                bases += len(line.rstrip(b"\r\n"))
+    return bases
+
+
+def format_float(value: float) -> str:
+    """Format a float like Rust's Display (e.g. 40 instead of 40.0)."""
+    if value != value:
+        return "NaN"
+    if value.is_integer():
+        return str(int(value))
+    return repr(value)
+
+
+def fast_coverage(args: argparse.Namespace):
+    ref_nt = count_fasta_bases(args.ref)
+    reads_nt = count_fastq_bases(args.reads, args.jobs)
+    if ref_nt:
+        coverage = reads_nt / ref_nt
+    else:
+        # like a floating point division by zero in Rust
+        coverage = float("inf") if reads_nt else float("nan")
+    out_file = sys.stdout if args.out == "-" else open(args.out, "w")
+    try:
+        out_file.write(f"reference nt: {ref_nt}\n")
+        out_file.write(f"reads nt: {reads_nt}\n")
+        out_file.write(f"coverage: {format_float(coverage)}x\n")
+    finally:
+        if out_file is not sys.stdout:
+            out_file.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="calculate various statistics for the Stan-X paper in a reproducible matter"
+    )
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    coverage_parser = subparsers.add_parser(
+        "fast_coverage",
+        help="calculate coverage in the naive way (number of nt in reads / number of nt in genome)",
+    )
+    coverage_parser.add_argument(
+        "-q",
+        "--reads",
+        required=True,
+        help='path to FASTQ reads file ("-" means standard input)',
+    )
+    coverage_parser.add_argument(
+        "-r",
+        "--ref",
+        required=True,
+        help='path to FASTA reference file ("-" means standard input)',
+    )
+    coverage_parser.add_argument(
+        "-o",
+        "--out",
+        required=True,
+        help='path to output file ("-" means standard output)',
+    )
+    coverage_parser.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        default=os.cpu_count() or 1,
+        help="number of processes counting the reads (default: all CPUs)",
+    )
+    coverage_parser.set_defaults(run=fast_coverage)
+
+    args = parser.parse_args()
+    profile_script()
+    args.run(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+"""parsing and classification of CIGAR strings
+
+Parsing is cached per distinct CIGAR string: a library only has a few thousand
+distinct CIGARs, so most records cost a dictionary lookup.
+"""
+
+import re
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import Iterable, List, Optional, Tuple
+
+CIGAR = re.compile(r"(?:\d+[MIDNSHP=X])+")
+CIGAR_OP = re.compile(r"(\d+)([MIDNSHP=X])")
+
+# operations that consume query / reference bases
+QUERY_OPS = "MIS=X"
+REF_OPS = "MDN=X"
+CLIP_OPS = "SH"
+# operations where read bases are aligned to reference bases
+MATCH_OPS = "M=X"
+
+
+@dataclass(frozen=True)
+class Cigar:
+    # soft/hard clipped bases at each end of the read
+    left_clip: int
+    right_clip: int
+    # read bases in the aligned part of the read (between the clips)
+    aligned: int
+    # reference bases covered by the alignment
+    ref_length: int
+
+
+def cigar_ops(cigar: str) -> List[Tuple[int, str]]:
+    """Split a CIGAR string into (length, operation) pairs."""
+    if not CIGAR.fullmatch(cigar):
+        raise ValueError(f"invalid CIGAR string: {cigar}")
+    return [(int(length), op) for length, op in CIGAR_OP.findall(cigar)]
+
+
+@lru_cache(maxsize=1 << 16)
+def parse_cigar(cigar: str) -> Optional[Cigar]:
+    """Summarize a CIGAR string (None if the read is unaligned, i.e. the CIGAR is "*")."""
+    if cigar == "*":
+        return None
+    ops = cigar_ops(cigar)
+
+    # clips (hard and/or soft) can only be at the ends
+    start = 0
+    left_clip = 0
+    while start < len(ops) and ops[start][1] in CLIP_OPS:
+        left_clip += ops[start][0]
+        start += 1
+    end = len(ops)
+    right_clip = 0
+    while end > start and ops[end - 1][1] in CLIP_OPS:
+        right_clip += ops[end - 1][0]
+        end -= 1
+
+    aligned = sum(length for length, op in ops[start:end] if op in QUERY_OPS)
+    ref_length = sum(length for length, op in ops[start:end] if op in REF_OPS)
+    return Cigar(left_clip, right_clip, aligned, ref_length)
+
+
+@lru_cache(maxsize=1 << 16)
+def aligned_blocks(cigar: str) -> Tuple[Tuple[int, int], ...]:
+    """(offset from POS, length) of each run of reference bases matched by the read."""
+    if cigar == "*":
+        return ()
+    blocks = []
+    offset = 0
+    for length, op in cigar_ops(cigar):
+        if op in MATCH_OPS:
+            blocks.append((offset, length))
+        if op in REF_OPS:
+            offset += length
+    return tuple(blocks)
+
+
+def parse_cigars(cigars: Iterable[str]) -> List[Optional[Cigar]]:
+    """Summarize a batch of CIGAR strings, parsing each distinct string once."""
+    cigars = list(cigars)
+    parsed = {cigar: parse_cigar(cigar) for cigar in set(cigars)}
+    return [parsed[cigar] for cigar in cigars]
+
+
+def is_left_clipped(cigar: Optional[Cigar]) -> bool:
+    """Is the read clipped at its start only (e.g. 112S38M)?"""
+    return cigar is not None and cigar.left_clip > 0 and cigar.right_clip == 0
+
+
+def is_right_clipped(cigar: Optional[Cigar]) -> bool:
+    """Is the read clipped at its end only (e.g. 41M109H)?"""
+    return cigar is not None and cigar.right_clip > 0 and cigar.left_clip == 0
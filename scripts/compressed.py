@@ -0,0 +1,179 @@
+"""transparent reading of plain, gzip and BGZF compressed input files
+
+The format is detected from the first bytes of the file, not its name. BGZF
+(the blocked gzip of samtools, bgzip and htslib) is a series of independent
+gzip members of at most 64 KiB each, with the size of each member in its
+header, so the compressed blocks can be read in order and inflated in
+parallel: batches of blocks are handed to a thread pool (zlib releases the GIL
+while inflating) and joined back in order. Other gzip files have to be
+inflated sequentially.
+
+Where a pipeline path names an uncompressed file that does not exist, its .gz
+version is used instead (see resolve).
+"""
+
+import gzip
+import io
+import os
+import struct
+import sys
+import zlib
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import IO, Deque, List, Optional
+
+GZIP_MAGIC = b"\x1f\x8b"
+
+# fixed part of a gzip member header, up to and including XLEN
+HEADER = struct.Struct("<2sBBIBBH")
+# gzip FLG bit for the extra field
+FEXTRA = 0x04
+
+# BGZF blocks inflated by one task, and tasks queued per thread
+BLOCKS_PER_TASK = 16
+TASKS_PER_THREAD = 4
+
+
+def resolve(path: str) -> str:
+    """The path, or its .gz version if only that exists."""
+    if path != "-" and not os.path.exists(path) and os.path.exists(f"{path}.gz"):
+        return f"{path}.gz"
+    return path
+
+
+def _magic(path: str, size: int) -> bytes:
+    with open(path, "rb") as in_file:
+        return in_file.read(size)
+
+
+def is_compressed(path: str) -> bool:
+    return path != "-" and _magic(path, 2) == GZIP_MAGIC
+
+
+def _bgzf_block_size(header: bytes, extra: bytes) -> Optional[int]:
+    """Total size of a BGZF block from its header and extra field (None if not BGZF)."""
+    magic, method, flags, _, _, _, _ = HEADER.unpack(header)
+    if magic != GZIP_MAGIC or method != 8 or not flags & FEXTRA:
+        return None
+    # the extra field is a list of (2 byte id, 2 byte length, data) subfields
+    offset = 0
+    while offset + 4 <= len(extra):
+        length = struct.unpack_from("<H", extra, offset + 2)[0]
+        if extra[offset : offset + 2] == b"BC" and length == 2:
+            return struct.unpack_from("<H", extra, offset + 4)[0] + 1
+        offset += 4 + length
+    return None
+
+
+def is_bgzf(path: str) -> bool:
+    if path == "-":
+        return False
+    start = _magic(path, HEADER.size + 256)
+    if len(start) < HEADER.size:
+        return False
+    xlen = HEADER.unpack_from(start)[-1]
+    extra = start[HEADER.size : HEADER.size + xlen]
+    return _bgzf_block_size(start[: HEADER.size], extra) is not None
+
+
+def _inflate(blocks: List[bytes]) -> bytes:
+    """Inflate whole BGZF blocks, checking their CRC and size."""
+    data = []
+    for block in blocks:
+        xlen = HEADER.unpack_from(block)[-1]
+        deflated = block[HEADER.size + xlen : -8]
+        crc, size = struct.unpack_from("<II", block, len(block) - 8)
+        inflated = zlib.decompress(deflated, -15)
+        if len(inflated) != size or zlib.crc32(inflated) != crc:
+            raise ValueError("corrupt BGZF block")
+        data.append(inflated)
+    return b"".join(data)
+
+
+class BgzfReader(io.RawIOBase):
+    """Raw binary stream of the decompressed data of a BGZF file."""
+
+    def __init__(self, path: str, threads: Optional[int] = None):
+        self._file = open(path, "rb")
+        threads = threads or os.cpu_count() or 1
+        self._pool = ThreadPoolExecutor(max_workers=threads)
+        self._max_pending = threads * TASKS_PER_THREAD
+        self._pending: Deque[Future] = deque()
+        self._buffer = memoryview(b"")
+        self._eof = False
+
+    def readable(self) -> bool:
+        return True
+
+    def _read_block(self) -> Optional[bytes]:
+        header = self._file.read(HEADER.size)
+        if not header:
+            return None
+        if len(header) < HEADER.size:
+            raise ValueError(f"{self._file.name}: truncated BGZF block")
+        xlen = HEADER.unpack(header)[-1]
+        extra = self._file.read(xlen)
+        size = _bgzf_block_size(header, extra)
+        if size is None:
+            raise ValueError(f"{self._file.name}: not a BGZF block")
+        rest = self._file.read(size - HEADER.size - xlen)
+        if len(rest) < size - HEADER.size - xlen:
+            raise ValueError(f"{self._file.name}: truncated BGZF block")
+        return header + extra + rest
+
+    def _submit(self):
+        """Queue batches of blocks until enough are in flight (or the file ends)."""
+        while not self._eof and len(self._pending) < self._max_pending:
+            blocks = []
+            while len(blocks) < BLOCKS_PER_TASK:
+                block = self._read_block()
+                if block is None:
+                    self._eof = True
+                    break
+                blocks.append(block)
+            if blocks:
+                self._pending.append(self._pool.submit(_inflate, blocks))
+
+    def readinto(self, buffer) -> int:
+        while not len(self._buffer):
+            self._submit()
+            if not self._pending:
+                return 0
+            self._buffer = memoryview(self._pending.popleft().result())
+        size = min(len(buffer), len(self._buffer))
+        buffer[:size] = self._buffer[:size]
+        self._buffer = self._buffer[size:]
+        return size
+
+    def close(self):
+        if not self.closed:
+            for future in self._pending:
+                future.cancel()
+            self._pool.shutdown()
+            self._file.close()
+        super().close()
+
+
+def open_input(
+    path: str,
+    mode: str = "rb",
+    buffer_size: int = io.DEFAULT_BUFFER_SIZE,
+    threads: Optional[int] = None,
+) -> IO:
+    """Open an input file for reading, decompressing it if needed.
+
+    path can be "-" for standard input (read as is), and mode "rb" or "r".
+    BGZF files are inflated by a pool of threads (all CPUs by default).
+    """
+    if mode not in ("r", "rb"):
+        raise ValueError(f"unsupported mode: {mode}")
+    if path == "-":
+        return sys.stdin.buffer if mode == "rb" else sys.stdin
+    path = resolve(path)
+    if is_bgzf(path):
+        binary = io.BufferedReader(BgzfReader(path, threads), buffer_size)
+    elif is_compressed(path):
+        binary = io.BufferedReader(gzip.open(path, "rb"), buffer_size)
+    else:
+        return open(path, mode, buffering=buffer_size)
+    return binary if mode == "rb" else io.TextIOWrapper(binary)
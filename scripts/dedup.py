@@ -0,0 +1,61 @@
+"""duplicate keys and consensus sequences for split reads
+
+PCR and optical duplicates are the same fragment read more than once, so they
+have the same sequence at the same position; the two mates of a fragment can
+also give the same sequence on opposite strands. Reads are keyed by a hash of
+their canonical sequence (the smaller of the sequence and its reverse
+complement), which the sequence table combines with the position and strand of
+the alignment.
+
+The distinct reads of a junction are then stacked on the junction (the first
+base after it in each read) and the consensus is the most common base of each
+column.
+"""
+
+from hashlib import blake2b
+from typing import Sequence, Tuple
+
+import numpy as np
+
+COMPLEMENT = str.maketrans("ACGTNacgtn", "TGCANtgcan")
+
+BASES = b"ACGTN"
+# index of each base in BASES (N for anything else)
+CODES = np.full(256, 4, dtype=np.uint8)
+for code, base in enumerate(BASES):
+    CODES[base] = CODES[base + 32] = code
+# value of the positions a read does not cover
+PAD = len(BASES)
+
+
+def reverse_complement(seq: str) -> str:
+    return seq.translate(COMPLEMENT)[::-1]
+
+
+def canonical(seq: str) -> str:
+    seq = seq.upper()
+    return min(seq, reverse_complement(seq))
+
+
+def sequence_hash(seq: str) -> bytes:
+    """Hash of a sequence that is the same for both strands."""
+    return blake2b(canonical(seq).encode(), digest_size=16).digest()
+
+
+def consensus(reads: Sequence[Tuple[str, int]]) -> Tuple[str, int]:
+    """Consensus of (sequence, offset of the junction) pairs, and its junction offset.
+
+    Columns are voted on by the reads that cover them; ties go to the first base
+    in ACGTN order.
+    """
+    before = max(split for _, split in reads)
+    after = max(len(seq) - split for seq, split in reads)
+    stack = np.full((len(reads), before + after), PAD, dtype=np.uint8)
+    for row, (seq, split) in enumerate(reads):
+        start = before - split
+        stack[row, start : start + len(seq)] = CODES[
+            np.frombuffer(seq.encode(), dtype=np.uint8)
+        ]
+    counts = np.stack([(stack == code).sum(axis=0) for code in range(len(BASES))])
+    bases = np.frombuffer(BASES, dtype=np.uint8)[counts.argmax(axis=0)]
+    return bases.tobytes().decode(), before
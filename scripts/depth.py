@@ -0,0 +1,136 @@
+"""per-base read depth in a window around each target
+
+The genome alignments are streamed once. Every aligned block of a read that
+overlaps a target window is recorded as a +1 at its start and a -1 past its end
+in a difference array, and the depth profiles of all the windows are then
+recovered with a cumulative sum. Like samtools depth, unmapped, secondary,
+QC-failed and duplicate alignments are not counted, and neither are deletions
+or skipped regions.
+
+usage: python3 scripts/depth.py [--cutoff CUTOFF] [--group GROUP] LIBRARY
+"""
+
+import argparse
+from array import array
+from dataclasses import dataclass
+from typing import List
+
+import numpy as np
+
+from cigar import aligned_blocks
+from profiling import profile_script
+from sam import CIGAR, FLAG, POS, RNAME, read_sam
+from target_registry import Target, TargetRegistry, load_targets
+
+# unmapped, secondary, QC-failed and duplicate alignments
+SKIP_FLAGS = 0x4 | 0x100 | 0x200 | 0x400
+
+
+@dataclass
+class DepthProfile:
+    target: Target
+    # first position of the window (1-based, like SAM)
+    start: int
+    # depth at each position of the window
+    depth: np.ndarray
+
+
+def depth_profiles(
+    sam_path: str, targets: TargetRegistry, default_cutoff: int
+) -> List[DepthProfile]:
+    """Depth profiles of the windows around targets, in a single pass over a SAM file."""
+    index = targets.index(default_cutoff)
+    number = {target.name: i for i, target in enumerate(targets)}
+    window_starts = np.array(
+        [target.pos - target.window(default_cutoff) for target in targets],
+        dtype=np.int64,
+    )
+    # the windows are laid out one after the other in a single difference array,
+    # each with one extra slot for the -1 past its last position
+    sizes = np.array(
+        [2 * target.window(default_cutoff) + 2 for target in targets], dtype=np.int64
+    )
+    offsets = np.concatenate([[0], np.cumsum(sizes)[:-1]]).astype(np.int64)
+
+    # aligned blocks that overlap a window, as (window, first position, last + 1)
+    block_windows = array("q")
+    block_starts = array("q")
+    block_ends = array("q")
+    for flag, chrom, pos, cigar in read_sam(sam_path, (FLAG, RNAME, POS, CIGAR)):
+        if int(flag) & SKIP_FLAGS:
+            continue
+        blocks = aligned_blocks(cigar)
+        if not blocks:
+            continue
+        pos = int(pos)
+        last_offset, last_length = blocks[-1]
+        for target in index.overlapping(
+            chrom, pos, pos + last_offset + last_length - 1
+        ):
+            for offset, length in blocks:
+                block_windows.append(number[target.name])
+                block_starts.append(pos + offset)
+                block_ends.append(pos + offset + length)
+
+    # positions relative to the window, clipped to it (so blocks outside add nothing)
+    windows = np.frombuffer(block_windows, dtype=np.int64)
+    limit = sizes[windows] - 1
+    first = np.clip(
+        np.frombuffer(block_starts, dtype=np.int64) - window_starts[windows], 0, limit
+    )
+    last = np.clip(
+        np.frombuffer(block_ends, dtype=np.int64) - window_starts[windows], 0, limit
+    )
+    diff = np.zeros(int(sizes.sum()), dtype=np.int64)
+    np.add.at(diff, offsets[windows] + first, 1)
+    np.add.at(diff, offsets[windows] + last, -1)
+
+    return [
+        DepthProfile(target, int(start), np.cumsum(diff[offset : offset + size - 1]))
+        for target, start, offset, size in zip(targets, window_starts, offsets, sizes)
+    ]
+
+
+def write_profiles(path: str, profiles: List[DepthProfile]):
+    with open(path, "w") as out_file:
+        out_file.write("Name,Chromosome,Position,Depth\n")
+        for profile in profiles:
+            prefix = f"{profile.target.name},{profile.target.chrom},"
+            out_file.write(
+                "".join(
+                    f"{prefix}{pos},{depth}\n"
+                    for pos, depth in enumerate(
+                        profile.depth.tolist(), start=profile.start
+                    )
+                )
+            )
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="per-base read depth around each target, from the genome alignments"
+    )
+    parser.add_argument("library", help="library to process (e.g. 7_R1_001)")
+    parser.add_argument(
+        "--cutoff",
+        type=int,
+        default=500,
+        help="bp on each side of a target (unless the target has its own cutoff)",
+    )
+    parser.add_argument(
+        "--group", help="only the targets of a group of the registry (default: all)"
+    )
+    args = parser.parse_args()
+    profile_script(args.library)
+
+    targets = load_targets()
+    if args.group is not None:
+        targets = targets.group(args.group)
+
+    folder = f"output/bwa_genome/{args.library}"
+    profiles = depth_profiles(f"{folder}/genome_aligned.sam", targets, args.cutoff)
+    write_profiles(f"{folder}/depth.csv", profiles)
+
+
+if __name__ == "__main__":
+    main()
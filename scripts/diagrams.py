@@ -0,0 +1,265 @@
+"""rendering of split read diagrams
+
+A diagram is a set of layers of bars (axis-aligned rectangles), each layer one
+color, drawn in order. The geometry of every bar is computed up front as numpy
+arrays, and each layer is then filled in one batch: into a palette image for
+PNG output, or as a single path for SVG output. Several diagrams can be tiled
+into one figure, which is rendered in the same single pass.
+
+Coordinates are in pixels, with the origin at the top left and both ends of
+every bar included (like PIL's ImageDraw.rectangle).
+"""
+
+from dataclasses import dataclass
+from typing import List, Optional, Sequence, Tuple
+
+import numpy as np
+from PIL import Image
+
+from results import SplitReads
+
+IMAGE_HEIGHT_MARGIN_EACH_SIDE = 100
+IMAGE_WIDTH_MARGIN_EACH_SIDE = 200
+BAR_HEIGHT = 5
+BAR_SPACING = 3
+BACKGROUND_COLOR = (255, 255, 255)
+INSERTION_COLOR = (0, 0, 255)
+TE_PART_COLOR = (0, 255, 0)
+GENOME_PART_COLOR = (255, 0, 0)
+
+# number of canvas pixels set at once (bounds the memory used by a fill)
+FILL_CHUNK_PIXELS = 1 << 22
+
+
+@dataclass
+class Bars:
+    """Bars of a single color: one entry per bar in each coordinate array."""
+
+    color: Tuple[int, int, int]
+    x0: np.ndarray
+    y0: np.ndarray
+    x1: np.ndarray
+    y1: np.ndarray
+
+    def __len__(self) -> int:
+        return len(self.x0)
+
+    def shifted(self, dx: int, dy: int) -> "Bars":
+        return Bars(self.color, self.x0 + dx, self.y0 + dy, self.x1 + dx, self.y1 + dy)
+
+    @classmethod
+    def concat(cls, bars: Sequence["Bars"]) -> "Bars":
+        """Bars of several (non-overlapping) diagrams as one layer."""
+        colors = {layer.color for layer in bars}
+        if len(colors) != 1:
+            raise ValueError(f"cannot merge layers of different colors: {colors}")
+        return cls(
+            colors.pop(),
+            *(
+                np.concatenate([getattr(layer, col) for layer in bars])
+                for col in ("x0", "y0", "x1", "y1")
+            ),
+        )
+
+
+@dataclass
+class Diagram:
+    width: int
+    height: int
+    # drawn in order, later layers on top
+    layers: List[Bars]
+
+
+def _band_rows(bottom: int, bands: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """Top and bottom rows of bands stacked upwards from `bottom` (band 0)."""
+    band_bottom = bottom - bands * (BAR_HEIGHT + BAR_SPACING)
+    return band_bottom - BAR_HEIGHT, band_bottom
+
+
+def _lengths(reads: SplitReads) -> Tuple[np.ndarray, np.ndarray]:
+    """(TE part, genome part) drawing lengths of each read."""
+    te_start, te_end, genome_start, genome_end = (
+        np.frombuffer(getattr(reads, col), dtype=np.int64)
+        for col in ("te_start", "te_end", "genome_start", "genome_end")
+    )
+    return te_end - te_start, genome_end - genome_start
+
+
+def insertion_diagram(
+    insertion_size: int, upstream: SplitReads, downstream: SplitReads
+) -> Diagram:
+    """Diagram of an insertion with its upstream and downstream split reads.
+
+    The reads are stacked above the insertion in the given order: upstream reads
+    as genome part then TE part from the start of the insertion, and downstream
+    reads as TE part then genome part from its end.
+    """
+    width = insertion_size + 2 * IMAGE_WIDTH_MARGIN_EACH_SIDE
+    height = (
+        BAR_HEIGHT
+        + max(len(upstream), len(downstream)) * (BAR_HEIGHT + BAR_SPACING)
+        + 2 * IMAGE_HEIGHT_MARGIN_EACH_SIDE
+    )
+    left = IMAGE_WIDTH_MARGIN_EACH_SIDE
+    right = left + insertion_size
+    bottom = height - IMAGE_HEIGHT_MARGIN_EACH_SIDE
+
+    top, bar_bottom = _band_rows(bottom, np.zeros(1, dtype=np.int64))
+    layers = [
+        Bars(INSERTION_COLOR, np.array([left]), top, np.array([right]), bar_bottom)
+    ]
+
+    # upstream reads end at the start of the insertion
+    te_length, genome_length = _lengths(upstream)
+    top, bar_bottom = _band_rows(bottom, np.arange(1, len(upstream) + 1))
+    at = np.full(len(upstream), left)
+    layers.append(Bars(GENOME_PART_COLOR, at - genome_length + 1, top, at, bar_bottom))
+    layers.append(Bars(TE_PART_COLOR, at, top, at + te_length + 1, bar_bottom))
+
+    # downstream reads start at the end of the insertion
+    te_length, genome_length = _lengths(downstream)
+    top, bar_bottom = _band_rows(bottom, np.arange(1, len(downstream) + 1))
+    at = np.full(len(downstream), right)
+    layers.append(Bars(TE_PART_COLOR, at - te_length + 1, top, at, bar_bottom))
+    layers.append(Bars(GENOME_PART_COLOR, at, top, at + genome_length + 1, bar_bottom))
+
+    return Diagram(width, height, layers)
+
+
+def tile(diagrams: List[Optional[Diagram]], columns: Optional[int] = None) -> Diagram:
+    """Lay out diagrams (all with the same layer structure) in a grid.
+
+    Each column is as wide as its widest diagram, and each row as high as its
+    highest one; a None leaves its cell empty. The layers of all the diagrams
+    are merged, so the whole grid is still filled in one batch per layer.
+    """
+    drawn = [diagram for diagram in diagrams if diagram is not None]
+    if not drawn:
+        raise ValueError("no diagrams to tile")
+    if len({len(diagram.layers) for diagram in drawn}) != 1:
+        raise ValueError("tiled diagrams must have the same layers")
+    if columns is None:
+        columns = int(np.ceil(np.sqrt(len(diagrams))))
+    grid = [diagrams[i : i + columns] for i in range(0, len(diagrams), columns)]
+
+    def size(diagram: Optional[Diagram]) -> Tuple[int, int]:
+        return (0, 0) if diagram is None else (diagram.width, diagram.height)
+
+    column_widths = [
+        max(size(row[col])[0] for row in grid if col < len(row))
+        for col in range(columns)
+    ]
+    column_offsets = np.concatenate([[0], np.cumsum(column_widths)])
+    row_heights = [max(size(diagram)[1] for diagram in row) for row in grid]
+    row_offsets = np.concatenate([[0], np.cumsum(row_heights)])
+
+    shifted = [
+        [
+            layer.shifted(int(column_offsets[col]), int(row_offsets[row]))
+            for layer in diagram.layers
+        ]
+        for row, diagrams_in_row in enumerate(grid)
+        for col, diagram in enumerate(diagrams_in_row)
+        if diagram is not None
+    ]
+    return Diagram(
+        int(column_offsets[-1]),
+        int(row_offsets[-1]),
+        [Bars.concat(layers) for layers in zip(*shifted)],
+    )
+
+
+def _clipped(bars: Bars, width: int, height: int) -> Bars:
+    """Bars with ordered corners, cut to the canvas (empty bars are dropped)."""
+    x0 = np.maximum(np.minimum(bars.x0, bars.x1), 0)
+    x1 = np.minimum(np.maximum(bars.x0, bars.x1), width - 1)
+    y0 = np.maximum(np.minimum(bars.y0, bars.y1), 0)
+    y1 = np.minimum(np.maximum(bars.y0, bars.y1), height - 1)
+    keep = (x0 <= x1) & (y0 <= y1)
+    return Bars(bars.color, x0[keep], y0[keep], x1[keep], y1[keep])
+
+
+def _expand(starts: np.ndarray, lengths: np.ndarray) -> np.ndarray:
+    """Concatenation of the ranges [start, start + length)."""
+    offsets = np.repeat(np.cumsum(lengths) - lengths, lengths)
+    return np.repeat(starts, lengths) + np.arange(offsets.size) - offsets
+
+
+def _fill(canvas: np.ndarray, bars: Bars, value: int):
+    """Set every pixel of the canvas that is covered by a bar to value."""
+    height, width = canvas.shape
+    bars = _clipped(bars, width, height)
+    if not len(bars):
+        return
+
+    # split the bars into one run of pixels per row, as offsets into the flat canvas
+    heights = bars.y1 - bars.y0 + 1
+    rows = _expand(bars.y0, heights)
+    run_starts = rows * width + np.repeat(bars.x0, heights)
+    run_lengths = np.repeat(bars.x1 - bars.x0 + 1, heights)
+
+    # set the pixels of many runs at once, in chunks of about FILL_CHUNK_PIXELS
+    flat = canvas.reshape(-1)
+    ends = np.cumsum(run_lengths)
+    lo = 0
+    while lo < len(run_starts):
+        hi = max(
+            lo + 1,
+            int(np.searchsorted(ends, ends[lo] - run_lengths[lo] + FILL_CHUNK_PIXELS)),
+        )
+        flat[_expand(run_starts[lo:hi], run_lengths[lo:hi])] = value
+        lo = hi
+
+
+def render_png(diagram: Diagram, path: str):
+    """Rasterize the diagram into a palette PNG (one byte per pixel)."""
+    palette = [BACKGROUND_COLOR]
+    canvas = np.zeros((diagram.height, diagram.width), dtype=np.uint8)
+    for layer in diagram.layers:
+        if layer.color not in palette:
+            palette.append(layer.color)
+        _fill(canvas, layer, palette.index(layer.color))
+
+    image = Image.fromarray(canvas, mode="P")
+    image.putpalette([channel for color in palette for channel in color])
+    image.save(path)
+
+
+def render_svg(diagram: Diagram, path: str):
+    """Write the diagram as an SVG, with one path per layer."""
+    with open(path, "w") as out_file:
+        out_file.write(
+            '<svg xmlns="http://www.w3.org/2000/svg" '
+            f'width="{diagram.width}" height="{diagram.height}" '
+            f'viewBox="0 0 {diagram.width} {diagram.height}" '
+            'shape-rendering="crispEdges">\n'
+            f'<rect width="100%" height="100%" fill="rgb{BACKGROUND_COLOR}"/>\n'
+        )
+        for layer in diagram.layers:
+            bars = _clipped(layer, diagram.width, diagram.height)
+            if not len(bars):
+                continue
+            widths = bars.x1 - bars.x0 + 1
+            heights = bars.y1 - bars.y0 + 1
+            out_file.write(f'<path fill="rgb{layer.color}" d="')
+            out_file.write(
+                "".join(
+                    f"M{x} {y}h{w}v{h}h-{w}z"
+                    for x, y, w, h in zip(
+                        bars.x0.tolist(),
+                        bars.y0.tolist(),
+                        widths.tolist(),
+                        heights.tolist(),
+                    )
+                )
+            )
+            out_file.write('"/>\n')
+        out_file.write("</svg>\n")
+
+
+def save(diagram: Diagram, path: str):
+    """Render the diagram as a PNG or an SVG, depending on the file extension."""
+    if path.endswith(".svg"):
+        render_svg(diagram, path)
+    else:
+        render_png(diagram, path)
@@ -0,0 +1,166 @@
+"""random access to FASTA files through a faidx index
+
+The index (<fasta>.fai) has the same format as `samtools faidx`, so either tool
+can build it. A FastaFile memory-maps the FASTA file and uses the index to turn
+a region into a byte range, so fetching a region costs O(1) seeks and the
+resident memory is only the pages that are actually read.
+
+usage: python3 scripts/fasta.py FASTA  (builds FASTA.fai)
+"""
+
+import mmap
+import os
+import sys
+from dataclasses import dataclass
+from typing import Dict, Iterator, List, Tuple
+
+from compressed import is_compressed, open_input
+
+
+@dataclass
+class FaiEntry:
+    name: str
+    # number of bases
+    length: int
+    # byte offset of the first base
+    offset: int
+    # bases per line, and bytes per line (including the newline)
+    line_bases: int
+    line_width: int
+
+
+def build_fai(fasta_path: str, fai_path: str):
+    """Index a FASTA file, whose lines must all have the same length (per record)."""
+    if is_compressed(fasta_path):
+        raise ValueError(
+            f"{fasta_path}: random access needs an uncompressed FASTA file"
+        )
+    entries: List[FaiEntry] = []
+    entry = None
+    # the line length of a record can only change at its last line
+    last_line_seen = False
+    offset = 0
+    with open(fasta_path, "rb") as in_file:
+        for line in in_file:
+            if line.startswith(b">"):
+                # the name is the header up to the first whitespace
+                name = (line[1:].split() or [b""])[0].decode()
+                entry = FaiEntry(name, 0, offset + len(line), 0, 0)
+                entries.append(entry)
+                last_line_seen = False
+            elif entry is not None:
+                bases = len(line.rstrip(b"\r\n"))
+                if entry.line_bases == 0:
+                    entry.line_bases, entry.line_width = bases, len(line)
+                elif last_line_seen and bases:
+                    raise ValueError(
+                        f"{fasta_path}: different line lengths in {entry.name}"
+                    )
+                last_line_seen = last_line_seen or bases < entry.line_bases
+                entry.length += bases
+            offset += len(line)
+
+    # write to a temporary file first, so concurrent readers never see a partial index
+    tmp_path = f"{fai_path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w") as out_file:
+        for entry in entries:
+            out_file.write(
+                f"{entry.name}\t{entry.length}\t{entry.offset}\t{entry.line_bases}\t{entry.line_width}\n"
+            )
+    os.replace(tmp_path, fai_path)
+
+
+def ensure_fai(fasta_path: str) -> str:
+    """Build the index of a FASTA file if it is missing or stale; its path.
+
+    Processes that open the same FASTA file should call this once beforehand,
+    rather than all rebuilding the index at the same time.
+    """
+    fai_path = f"{fasta_path}.fai"
+    stale = not os.path.exists(fai_path) or (
+        os.path.getmtime(fai_path) < os.path.getmtime(fasta_path)
+    )
+    if stale:
+        build_fai(fasta_path, fai_path)
+    return fai_path
+
+
+def read_fai(fai_path: str) -> Dict[str, FaiEntry]:
+    entries = {}
+    with open(fai_path, "r") as in_file:
+        for line in in_file:
+            name, length, offset, line_bases, line_width = line.split("\t")[:5]
+            entries[name] = FaiEntry(
+                name, int(length), int(offset), int(line_bases), int(line_width)
+            )
+    return entries
+
+
+def read_fasta(path: str) -> Iterator[Tuple[str, str]]:
+    """Yield the (name, sequence) of each record of a (possibly compressed) FASTA file."""
+    name = None
+    lines: List[str] = []
+    with open_input(path, "r") as in_file:
+        for line in in_file:
+            if line.startswith(">"):
+                if name is not None:
+                    yield name, "".join(lines)
+                name = (line[1:].split() or [""])[0]
+                lines = []
+            else:
+                lines.append(line.strip())
+    if name is not None:
+        yield name, "".join(lines)
+
+
+class FastaFile:
+    """A memory-mapped FASTA file with a faidx index.
+
+    The index is built next to the FASTA file if it is missing or older than
+    the FASTA file.
+    """
+
+    def __init__(self, path: str):
+        if is_compressed(path):
+            raise ValueError(f"{path}: random access needs an uncompressed FASTA file")
+        self.entries = read_fai(ensure_fai(path))
+        self._file = open(path, "rb")
+        self._data = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def close(self):
+        self._data.close()
+        self._file.close()
+
+    def __enter__(self) -> "FastaFile":
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __contains__(self, name: str) -> bool:
+        return name in self.entries
+
+    def length(self, name: str) -> int:
+        return self.entries[name].length
+
+    def _byte(self, entry: FaiEntry, base: int) -> int:
+        """Byte offset of a (0-based) base of a record."""
+        line, column = divmod(base, entry.line_bases)
+        return entry.offset + line * entry.line_width + column
+
+    def fetch(self, name: str, start: int, end: int) -> str:
+        """Bases start..end (1-based, inclusive, like samtools) of a record.
+
+        The region is cut to the record, so it can be shorter than asked for.
+        """
+        entry = self.entries[name]
+        start = max(start, 1)
+        end = min(end, entry.length)
+        if end < start:
+            return ""
+        raw = self._data[self._byte(entry, start - 1) : self._byte(entry, end - 1) + 1]
+        return raw.replace(b"\n", b"").replace(b"\r", b"").decode()
+
+
+if __name__ == "__main__":
+    build_fai(sys.argv[1], f"{sys.argv[1]}.fai")
@@ -0,0 +1,125 @@
+import argparse
+import os
+from typing import Dict, List
+
+from alignment_store import AlignmentStore
+from cigar import is_left_clipped, parse_cigar
+from pairs import fragment_name, hash_join, libraries
+from profiling import profile_script
+from sam import CIGAR, POS, QNAME, RNAME, read_sam_lines, split_fields
+from target_registry import load_targets
+
+# list of SX-4 insertions within a natural TE,
+# found through inverse PCR (taken from Google Sheet)
+targets = load_targets().group("table1")
+
+# number of bp on each side of the insertion that we allow the read to be
+# (unless the target has its own cutoff)
+cutoff = 500
+
+# window around each target, keyed by chromosome
+index = targets.index(cutoff)
+
+
+def target_reads(result_folder_name: str) -> Dict[str, List[str]]:
+    """Relevant genome alignment lines for each target in a library"""
+    reads: Dict[str, List[str]] = {tgt.name: [] for tgt in targets}
+
+    sam_path = f"output/bwa_genome/{result_folder_name}/genome_aligned.sam"
+    store_path = f"output/bwa_genome/{result_folder_name}/genome_aligned.store"
+
+    # trailing newline is included in each line
+    if os.path.exists(store_path):
+        # query the window around each target
+        with AlignmentStore(store_path) as store:
+            for tgt in targets:
+                for line in store.fetch(
+                    tgt.chrom,
+                    tgt.pos - tgt.window(cutoff),
+                    tgt.pos + tgt.window(cutoff),
+                ):
+                    # only get reads that aren't 150M
+                    if is_left_clipped(parse_cigar(split_fields(line, (CIGAR,))[0])):
+                        reads[tgt.name].append(line)
+    else:
+        # check every alignment against the target windows
+        for line in read_sam_lines(sam_path):
+            # extract useful info
+            chrom, genome_pos, cigar_string = split_fields(line, (RNAME, POS, CIGAR))
+            # only get reads that aren't 150M
+            if not is_left_clipped(parse_cigar(cigar_string)):
+                continue
+
+            for tgt in index.containing(chrom, int(genome_pos)):
+                reads[tgt.name].append(line)
+
+    for tgt in targets:
+        print(f"found {len(reads[tgt.name])} reads for {tgt.name} in file {sam_path}")
+    return reads
+
+
+def write_target_reads(result_folder_name: str, reads: Dict[str, List[str]]):
+    for tgt in targets:
+        with open(
+            f"output/bwa_genome/{result_folder_name}/{tgt.name.lower()}_reads.txt", "w"
+        ) as out_file:
+            for read in reads[tgt.name]:
+                out_file.write(read)
+
+
+def write_tube_support(
+    tube_name: str, r1_reads: Dict[str, List[str]], r2_reads: Dict[str, List[str]]
+):
+    """Reads, fragments and fragments with both mates for each target in a tube"""
+
+    def named(reads: Dict[str, List[str]]):
+        for name, lines in reads.items():
+            for line in lines:
+                yield fragment_name(split_fields(line, (QNAME,))[0]), name
+
+    # [R1 reads, R2 reads, fragments, fragments with both mates] for each target
+    support = {tgt.name: [0, 0, 0, 0] for tgt in targets}
+    for _, r1, r2 in hash_join(named(r1_reads), named(r2_reads)):
+        for name in set(r1) | set(r2):
+            counts = support[name]
+            counts[0] += r1.count(name)
+            counts[1] += r2.count(name)
+            counts[2] += 1
+            counts[3] += name in r1 and name in r2
+
+    with open(f"output/bwa_genome/{tube_name}_target_support.csv", "w") as out_file:
+        out_file.write("Name,R1 Reads,R2 Reads,Fragments,Both Mates\n")
+        for tgt in targets:
+            out_file.write(f"{tgt.name},{','.join(map(str, support[tgt.name]))}\n")
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="find the genome reads around each table 1 target"
+    )
+    parser.add_argument(
+        "library", help="library to process (e.g. 7_R1_001), or a tube with --paired"
+    )
+    parser.add_argument(
+        "--paired",
+        action="store_true",
+        help="process both libraries of a tube (e.g. 7), and write the support for "
+        "each target in the tube to output/bwa_genome/<tube>_target_support.csv",
+    )
+    args = parser.parse_args()
+    profile_script(args.library)
+
+    if not args.paired:
+        write_target_reads(args.library, target_reads(args.library))
+        return
+
+    r1_library, r2_library = libraries(args.library)
+    r1_reads = target_reads(r1_library)
+    r2_reads = target_reads(r2_library)
+    write_target_reads(r1_library, r1_reads)
+    write_target_reads(r2_library, r2_reads)
+    write_tube_support(args.library, r1_reads, r2_reads)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,19 +1,18 @@
+import os
 import sys
-from dataclasses import dataclass
 from typing import List
 
-result_folder_name = sys.argv[1]
-
+from alignment_store import AlignmentStore
+from profiling import profile_script
+from results import te_family
+from sam import POS, QNAME, RNAME, read_sam_lines, split_fields
+from target_registry import load_targets
 
-@dataclass
-class Tgt:
-    name: str
-    te_name: str
-    chrom: str
-    pos: int
+result_folder_name = sys.argv[1]
+profile_script(result_folder_name)
 
 
-target = Tgt("SX4Et51", "copia", "2R", 9_237_984)
+target = load_targets().get("SX4Et51")
 
 # number of bp on each side of the insertion that we allow the transposon to be
 cutoff = 10_000
@@ -21,30 +20,37 @@ cutoff = 10_000
 # list of relevant reads
 reads: List[str] = []
 
-with open(f"output/te_mapper/{result_folder_name}/genome_aligned.sam", "r") as in_file:
-    # readlines: trailing newline is included
-    for line in in_file.readlines():
-        # skip header lines
-        if line.startswith("@SQ") or line.startswith("@PG"):
-            continue
-
-        # extract useful info
-        tabs = line.split("\t")
-        te_name = tabs[0].split("|")[1]
-        chrom = tabs[2]
-        genome_pos = int(tabs[3])
-
-        # only add insertions that correspond to the same element
-        if (
-            te_name.startswith(target.te_name)
-            and chrom == target.chrom
-            and abs(genome_pos - target.pos) <= cutoff
-        ):
+sam_path = f"output/te_mapper/{result_folder_name}/genome_aligned.sam"
+store_path = f"output/te_mapper/{result_folder_name}/genome_aligned.store"
+
+
+def is_target_read(line: str) -> bool:
+    """Does the alignment correspond to the same element as the target?"""
+    # extract useful info
+    read_name, chrom, genome_pos = split_fields(line, (QNAME, RNAME, POS))
+    te_name = read_name.split("|")[1]
+    genome_pos = int(genome_pos)
+
+    # only add insertions that correspond to the same element
+    return (
+        te_family(te_name) == te_family(target.te_name)
+        and chrom == target.chrom
+        and abs(genome_pos - target.pos) <= cutoff
+    )
+
+
+# trailing newline is included in each line
+if os.path.exists(store_path):
+    with AlignmentStore(store_path) as store:
+        for line in store.fetch(target.chrom, target.pos - cutoff, target.pos + cutoff):
+            if is_target_read(line):
+                reads.append(line)
+else:
+    for line in read_sam_lines(sam_path):
+        if is_target_read(line):
             reads.append(line)
 
-print(
-    f"found {len(reads)} reads for SX4Et51 in file output/te_mapper/{result_folder_name}/genome_aligned.sam"
-)
+print(f"found {len(reads)} reads for SX4Et51 in file {sam_path}")
 
 with open(f"output/te_mapper/{result_folder_name}/sx4et51_reads.txt", "w") as out_file:
     for read in reads:
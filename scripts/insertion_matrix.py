@@ -0,0 +1,206 @@
+"""support for every target in every library, as a targets x libraries matrix
+
+The te_mapper results of the libraries are loaded concurrently (one process per
+library), and each process only sends back the non-zero cells of its column:
+the upstream and downstream split read counts of the calls near each target.
+The matrix is kept as a dict of keys, so its size is the number of targets
+actually found rather than targets x libraries.
+
+usage: python3 scripts/insertion_matrix.py [-j JOBS] [--group GROUP] [LIBRARY ...]
+"""
+
+import argparse
+import os
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from typing import Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+from pairs import LIBRARIES
+from profiling import profile_script
+from results import ResultIndex, load_results
+from target_registry import REGISTRY_PATH, TargetRegistry, load_targets
+
+# number of bp on each side of a target to look for calls (unless it has its own)
+CUTOFF = 1_000
+
+
+class SupportMatrix:
+    """Sparse (dict of keys) matrix of (upstream, downstream) read counts."""
+
+    def __init__(self, targets: List[str], libraries: List[str]):
+        self.targets = targets
+        self.libraries = libraries
+        # (target, library) -> (upstream reads, downstream reads), non-zero only
+        self.cells: Dict[Tuple[int, int], Tuple[int, int]] = {}
+
+    @property
+    def shape(self) -> Tuple[int, int]:
+        return len(self.targets), len(self.libraries)
+
+    def __getitem__(self, key: Tuple[int, int]) -> Tuple[int, int]:
+        return self.cells.get(key, (0, 0))
+
+    def nonzero(self) -> Iterator[Tuple[int, int, int, int]]:
+        """(target, library, upstream reads, downstream reads) of the non-zero cells."""
+        for (i, j), (upstream, downstream) in sorted(self.cells.items()):
+            yield i, j, upstream, downstream
+
+    def to_dense(self) -> np.ndarray:
+        """(targets, libraries, 2) array of the upstream and downstream counts."""
+        dense = np.zeros((*self.shape, 2), dtype=np.int64)
+        for (i, j), counts in self.cells.items():
+            dense[i, j] = counts
+        return dense
+
+
+def select_targets(registry_path: str, group: Optional[str]) -> TargetRegistry:
+    targets = load_targets(registry_path)
+    return targets.group(group) if group is not None else targets
+
+
+def library_support(
+    library: str, registry_path: str, group: Optional[str], cutoff: int
+) -> Dict[int, Tuple[int, int]]:
+    """Upstream and downstream reads of the calls near each target in a library.
+
+    Unlike the table 1 scripts, more than one call near a target is not an
+    error: the reads of all of them are added up.
+    """
+    targets = select_targets(registry_path, group)
+    index = ResultIndex(
+        load_results(f"output/te_mapper/{library}/te_mapper_output.json")
+    )
+    column = {}
+    for i, tgt in enumerate(targets):
+        upstream = downstream = 0
+        for result in index.near(tgt.te_name, tgt.chrom, tgt.pos, tgt.window(cutoff)):
+            # the index only narrows down to the TE family
+            if result.name == tgt.te_name:
+                upstream += len(result.upstream_reads)
+                downstream += len(result.downstream_reads)
+        if upstream or downstream:
+            column[i] = (upstream, downstream)
+    return column
+
+
+def support_matrix(
+    libraries: List[str],
+    registry_path: str = REGISTRY_PATH,
+    group: Optional[str] = None,
+    cutoff: int = CUTOFF,
+    jobs: int = 1,
+) -> SupportMatrix:
+    targets = select_targets(registry_path, group)
+    matrix = SupportMatrix([tgt.name for tgt in targets], libraries)
+    support = partial(
+        library_support, registry_path=registry_path, group=group, cutoff=cutoff
+    )
+    if jobs > 1:
+        with ProcessPoolExecutor(max_workers=jobs) as pool:
+            columns = list(pool.map(support, libraries))
+    else:
+        columns = [support(library) for library in libraries]
+    for j, column in enumerate(columns):
+        for i, counts in column.items():
+            matrix.cells[i, j] = counts
+    return matrix
+
+
+def write_matrix(path: str, matrix: SupportMatrix):
+    """One row per target, with an upstream and a downstream column per library."""
+    dense = matrix.to_dense()
+    with open(path, "w") as out_file:
+        out_file.write(
+            "Name,"
+            + ",".join(
+                f"{library} Upstream,{library} Downstream"
+                for library in matrix.libraries
+            )
+            + "\n"
+        )
+        for name, row in zip(matrix.targets, dense):
+            out_file.write(f"{name},{','.join(map(str, row.ravel().tolist()))}\n")
+
+
+def write_sparse(path: str, matrix: SupportMatrix):
+    """One row per non-zero (target, library) cell."""
+    with open(path, "w") as out_file:
+        out_file.write("Name,Library,Upstream Reads,Downstream Reads\n")
+        for i, j, upstream, downstream in matrix.nonzero():
+            out_file.write(
+                f"{matrix.targets[i]},{matrix.libraries[j]},{upstream},{downstream}\n"
+            )
+
+
+def all_libraries() -> List[str]:
+    """Every library with te_mapper results."""
+    return [
+        library
+        for library in LIBRARIES
+        if os.path.exists(f"output/te_mapper/{library}/te_mapper_output.json")
+    ]
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="split read support for every target in every library"
+    )
+    parser.add_argument(
+        "libraries",
+        nargs="*",
+        help="libraries to scan (default: all with te_mapper results)",
+    )
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        default=os.cpu_count() or 1,
+        help="number of libraries to load in parallel (default: all CPUs)",
+    )
+    parser.add_argument(
+        "--targets",
+        default=REGISTRY_PATH,
+        help="target registry (default: targets.csv)",
+    )
+    parser.add_argument(
+        "--group", help="only the targets of a group of the registry (default: all)"
+    )
+    parser.add_argument(
+        "--cutoff",
+        type=int,
+        default=CUTOFF,
+        help="bp on each side of a target (unless the target has its own cutoff)",
+    )
+    parser.add_argument(
+        "--sparse",
+        action="store_true",
+        help="write one row per non-zero (target, library) instead of the full matrix",
+    )
+    parser.add_argument(
+        "-o",
+        "--out",
+        default="output/te_mapper/insertion_matrix.csv",
+        help="output CSV file",
+    )
+    args = parser.parse_args()
+    profile_script()
+
+    libraries = args.libraries or all_libraries()
+    matrix = support_matrix(
+        libraries,
+        args.targets,
+        args.group,
+        args.cutoff,
+        min(args.jobs, len(libraries)),
+    )
+    print(
+        f"{len(matrix.cells)} of {matrix.shape[0]} x {matrix.shape[1]} "
+        "(target, library) pairs have split reads"
+    )
+    (write_sparse if args.sparse else write_matrix)(args.out, matrix)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,53 @@
+"""index of closed integer intervals for fast overlap queries"""
+
+from bisect import bisect_left, bisect_right
+from typing import Dict, Generic, Hashable, List, Tuple, TypeVar
+
+T = TypeVar("T")
+
+
+class IntervalIndex(Generic[T]):
+    """Closed intervals grouped by key (usually the chromosome name).
+
+    Intervals are kept sorted by start position, so a query only looks at the
+    intervals that start between (query start - longest interval) and the query
+    end: O(log n) to find them, plus the number of intervals in that range.
+    """
+
+    def __init__(self):
+        self._pending: Dict[Hashable, List[Tuple[int, int, T]]] = {}
+        self._starts: Dict[Hashable, List[int]] = {}
+        self._entries: Dict[Hashable, List[Tuple[int, int, T]]] = {}
+        self._max_length: Dict[Hashable, int] = {}
+
+    def add(self, key: Hashable, start: int, end: int, item: T):
+        """Add the interval [start, end] under the given key."""
+        if end < start:
+            raise ValueError(f"interval end {end} is before its start {start}")
+        self._pending.setdefault(key, []).append((start, end, item))
+
+    def _build(self):
+        for key, pending in self._pending.items():
+            entries = self._entries.get(key, []) + pending
+            # sort on the coordinates only (items do not have to be comparable)
+            entries.sort(key=lambda entry: (entry[0], entry[1]))
+            self._entries[key] = entries
+            self._starts[key] = [entry[0] for entry in entries]
+            self._max_length[key] = max(entry[1] - entry[0] for entry in entries)
+        self._pending = {}
+
+    def overlapping(self, key: Hashable, start: int, end: int) -> List[T]:
+        """Items whose interval overlaps [start, end], in order of interval start."""
+        if self._pending:
+            self._build()
+        starts = self._starts.get(key)
+        if starts is None:
+            return []
+        entries = self._entries[key]
+        lo = bisect_left(starts, start - self._max_length[key])
+        hi = bisect_right(starts, end)
+        return [entry[2] for entry in entries[lo:hi] if entry[1] >= start]
+
+    def containing(self, key: Hashable, pos: int) -> List[T]:
+        """Items whose interval contains pos."""
+        return self.overlapping(key, pos, pos)
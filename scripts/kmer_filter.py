@@ -0,0 +1,170 @@
+"""k-mer pre-filter for reads that touch a TE
+
+usage:
+    python3 scripts/kmer_filter.py index [-k K] -o INDEX.npz FASTA [FASTA ...]
+    python3 scripts/kmer_filter.py filter -i INDEX.npz -q READS.fastq -o OUT.fastq
+
+The index holds every canonical k-mer (the smaller of a k-mer and its reverse
+complement, packed 2 bits per base into a 64-bit integer) of the TE sequences,
+as a sorted array. The filter streams the FASTQ in batches of records; the
+k-mers of a whole batch are packed with a few numpy operations and looked up in
+the index with a binary search, and only the records with enough hits are
+written out (unchanged). k-mers containing anything but A, C, G or T are
+skipped.
+"""
+
+import argparse
+import sys
+from itertools import islice
+from typing import Iterable, Iterator, List, Tuple
+
+import numpy as np
+
+from compressed import open_input
+from fasta import read_fasta
+from profiling import profile_script
+
+# default k-mer length (at most 32, so a k-mer fits in 64 bits)
+K = 21
+
+# FASTQ records filtered at once
+BATCH_SIZE = 1 << 16
+
+# 2-bit code of each base (4 for anything else)
+CODES = np.full(256, 4, dtype=np.uint8)
+for code, base in enumerate(b"ACGT"):
+    CODES[base] = CODES[base + 32] = code
+
+
+def canonical_kmers(seqs: List[bytes], k: int) -> Tuple[np.ndarray, np.ndarray]:
+    """Canonical k-mers of a batch of sequences, and the sequence each one is from."""
+    lengths = np.array([len(seq) for seq in seqs], dtype=np.int64)
+    codes = CODES[np.frombuffer(b"".join(seqs), dtype=np.uint8)]
+    starts = np.concatenate([[0], np.cumsum(lengths)]).astype(np.int64)
+    count = max(len(codes) - k + 1, 0)
+
+    # a k-mer is valid if it lies within one sequence and has no ambiguous bases
+    invalid = np.concatenate([[0], np.cumsum(codes == 4)])
+    valid = invalid[k : k + count] == invalid[:count]
+    owner = np.repeat(np.arange(len(seqs)), lengths)[:count]
+    valid &= np.arange(count) + k <= starts[owner + 1]
+
+    forward = np.zeros(count, dtype=np.uint64)
+    reverse = np.zeros(count, dtype=np.uint64)
+    bases = np.minimum(codes, 3).astype(np.uint64)
+    for j in range(k):
+        window = bases[j : j + count]
+        forward = (forward << np.uint64(2)) | window
+        reverse |= (np.uint64(3) - window) << np.uint64(2 * j)
+    return np.minimum(forward, reverse)[valid], owner[valid]
+
+
+def build_index(fasta_paths: Iterable[str], k: int) -> np.ndarray:
+    """Sorted, distinct canonical k-mers of all the sequences of FASTA files."""
+    kmers = [
+        canonical_kmers([seq.encode()], k)[0]
+        for path in fasta_paths
+        for _, seq in read_fasta(path)
+    ]
+    return np.unique(np.concatenate(kmers)) if kmers else np.zeros(0, np.uint64)
+
+
+def load_index(path: str) -> Tuple[np.ndarray, int]:
+    with np.load(path) as data:
+        return data["kmers"], int(data["k"])
+
+
+def read_fastq_records(path: str) -> Iterator[List[bytes]]:
+    """Yield the 4 lines (with newlines) of each record of a FASTQ file."""
+    with open_input(path) as in_file:
+        while True:
+            record = list(islice(in_file, 4))
+            if not record:
+                return
+            if len(record) < 4:
+                raise ValueError(f"{path}: truncated FASTQ record")
+            yield record
+
+
+def kmer_hits(index: np.ndarray, k: int, seqs: List[bytes]) -> np.ndarray:
+    """Number of the k-mers of each sequence that are in the index."""
+    kmers, owner = canonical_kmers(seqs, k)
+    found = np.searchsorted(index, kmers)
+    found = np.minimum(found, len(index) - 1)
+    hits = index[found] == kmers if len(index) else np.zeros(len(kmers), bool)
+    return np.bincount(owner[hits], minlength=len(seqs))
+
+
+def filter_fastq(
+    index: np.ndarray, k: int, in_path: str, out_file, min_hits: int = 1
+) -> Tuple[int, int]:
+    """Write the records with at least min_hits k-mers in the index; (kept, total)."""
+    kept = total = 0
+    records = read_fastq_records(in_path)
+    while True:
+        batch = list(islice(records, BATCH_SIZE))
+        if not batch:
+            return kept, total
+        hits = kmer_hits(index, k, [record[1].rstrip(b"\r\n") for record in batch])
+        for record, count in zip(batch, hits.tolist()):
+            if count >= min_hits:
+                out_file.writelines(record)
+                kept += 1
+        total += len(batch)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="keep only the reads that share k-mers with a set of TEs"
+    )
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    index_parser = subparsers.add_parser("index", help="build a k-mer index")
+    index_parser.add_argument("-k", type=int, default=K, help="k-mer length")
+    index_parser.add_argument("-o", "--out", required=True, help="index (.npz)")
+    index_parser.add_argument("fasta", nargs="+", help="TE sequences (FASTA)")
+
+    filter_parser = subparsers.add_parser("filter", help="filter a FASTQ file")
+    filter_parser.add_argument("-i", "--index", required=True, help="index (.npz)")
+    filter_parser.add_argument(
+        "-q",
+        "--reads",
+        required=True,
+        help='path to FASTQ reads file ("-" means standard input)',
+    )
+    filter_parser.add_argument(
+        "-o",
+        "--out",
+        required=True,
+        help='path to output FASTQ file ("-" means standard output)',
+    )
+    filter_parser.add_argument(
+        "--min-hits",
+        type=int,
+        default=1,
+        help="number of k-mers a read must share with the TEs",
+    )
+    args = parser.parse_args()
+    profile_script()
+
+    if args.command == "index":
+        if not 0 < args.k <= 32:
+            parser.error("k must be between 1 and 32")
+        kmers = build_index(args.fasta, args.k)
+        with open(args.out, "wb") as out_file:
+            np.savez(out_file, kmers=kmers, k=args.k)
+        print(f"indexed {len(kmers)} {args.k}-mers", file=sys.stderr)
+        return
+
+    index, k = load_index(args.index)
+    out_file = sys.stdout.buffer if args.out == "-" else open(args.out, "wb")
+    try:
+        kept, total = filter_fastq(index, k, args.reads, out_file, args.min_hits)
+    finally:
+        if out_file is not sys.stdout.buffer:
+            out_file.close()
+    print(f"kept {kept} of {total} reads", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,201 +1,695 @@
-import json
-import re
-from dataclasses import dataclass
-from typing import Dict, List, Optional
-
-result_folders = {
-    "output/te_mapper/1_R1_001": "1_R1_001.fastq",
-    "output/te_mapper/1_R2_001": "1_R2_001.fastq",
-    "output/te_mapper/2_R1_001": "2_R1_001.fastq",
-    "output/te_mapper/2_R2_001": "2_R2_001.fastq",
-    "output/te_mapper/7_R1_001": "7_R1_001.fastq",
-    "output/te_mapper/7_R2_001": "7_R2_001.fastq",
-    "output/te_mapper/8_R1_001": "8_R1_001.fastq",
-    "output/te_mapper/8_R2_001": "8_R2_001.fastq",
-}
+import argparse
+import os
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field, replace
+from functools import partial
+from itertools import islice
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+from alignment_store import AlignmentStore
+from cigar import is_left_clipped, is_right_clipped, parse_cigar
+from dedup import consensus, sequence_hash
+from fasta import FastaFile, ensure_fai
+from intervals import IntervalIndex
+from pairs import LIBRARIES, TUBES, fragment_name, hash_join, libraries, tube
+from profiling import profile_script, stage
+from results import Result, ResultIndex, load_results
+from sam import CIGAR, FLAG, POS, QNAME, RNAME, SEQ, read_sam, split_fields
+from tables import open_table
+from target_registry import Target, load_targets
+from verify import MIN_SCORE, Verifier
 
 result_folders_inv = {
-    "1_R1_001.fastq": "output/te_mapper/1_R1_001",
-    "1_R2_001.fastq": "output/te_mapper/1_R2_001",
-    "2_R1_001.fastq": "output/te_mapper/2_R1_001",
-    "2_R2_001.fastq": "output/te_mapper/2_R2_001",
-    "7_R1_001.fastq": "output/te_mapper/7_R1_001",
-    "7_R2_001.fastq": "output/te_mapper/7_R2_001",
-    "8_R1_001.fastq": "output/te_mapper/8_R1_001",
-    "8_R2_001.fastq": "output/te_mapper/8_R2_001",
+    f"{library}.fastq": f"output/te_mapper/{library}" for library in LIBRARIES
 }
 
 
-@dataclass
-class Tgt:
-    name: str
-    te_name: str
-    chrom: str
-    pos: int
-
-
 # list of relevant SX-4 insertions,
 # confirmed through inverse PCR
-targets: List[Tgt] = [
-    Tgt("SX4Ch7", "1360#DNA/P", "2L", 12_004_570),
-    Tgt("SX4Aq839", "1360#DNA/P", "2L", 16_727_570),
-    Tgt("SX4Et51", "copia#LTR/Copia", "2R", 9_237_984),
-    Tgt("SX4Et8", "HMS-Beagle#LTR/Gypsy", "2R", 15_951_007),
-]
+targets = load_targets().group("sequence_table")
 
 # number of bp on each side of the insertion that we allow the transposon to be
 cutoff = 1_000
 
+# number of bp of reference sequence on each side of a junction (with --ref)
+flank = 50
 
-@dataclass
-class SplitReadRanges:
-    te_range: List[int]
-    genome_range: List[int]
+# rows whose TE parts are aligned together (with --verify)
+VERIFY_BATCH = 1 << 16
+
+
+def candidates(tgt: Target, index: ResultIndex) -> List[Result]:
+    """Results that are candidates to be the target"""
+    # check that it is the same transposon (the index only narrows down to the family)
+    return [
+        result
+        for result in index.near(tgt.te_name, tgt.chrom, tgt.pos, tgt.window(cutoff))
+        if result.name == tgt.te_name
+    ]
 
 
 @dataclass
-class Result:
-    ref: bool
-    name: str
+class SplitRead:
+    te_name: str
     chrom: str
-    upstream_pos: int
-    downstream_pos: int
-    orientation: str
-    upstream_reads: List[SplitReadRanges]
-    downstream_reads: List[SplitReadRanges]
-    target_name: Optional[str] = None
-    te_name: Optional[str] = None
-
-
-results: Dict[str, List[Result]] = {}
-
-for result_folder in result_folders:
-    results[result_folders[result_folder]] = []
-    with open(f"{result_folder}/te_mapper_output.json", "r") as in_file:
-        raw = json.load(in_file)
-        for chrom in raw:
-            for result in chrom["non_reference"]:
-                results[result_folders[result_folder]].append(Result(False, **result))
-            for result in chrom["reference"]:
-                results[result_folders[result_folder]].append(Result(True, **result))
-        for result in results[result_folders[result_folder]]:
-            result.upstream_reads = [
-                SplitReadRanges(**x) for x in result.upstream_reads
-            ]
-            result.downstream_reads = [
-                SplitReadRanges(**x) for x in result.downstream_reads
-            ]
+    pos: int
+    sequence: str
+    upstream: bool
+    # genome position next to the TE part of the read
+    junction: int
+    # number of bases in the TE part of the read
+    te_length: int
+    # name of the fragment the read is from (shared by its mate)
+    fragment: str = ""
+    # aligned to the reverse strand of the genome (SAM flag 0x10)
+    reverse: bool = False
+
+    def te_part(self) -> str:
+        """The bases of the read that match the TE."""
+        if self.upstream:
+            return self.sequence[len(self.sequence) - self.te_length :]
+        return self.sequence[: self.te_length]
+
+    def split(self) -> int:
+        """Index of the first base of the read after the junction."""
+        if self.upstream:
+            return len(self.sequence) - self.te_length
+        return self.te_length
 
 
-def candidate(tgt: Tgt, res: Result) -> bool:
-    """Is the result a candidate to be the target?"""
+@dataclass
+class Row:
+    fastq_filename: str
+    insertion_line: str
+    natural_te: str
+    sequence: str
+    upstream: bool
+    # reference sequence around the junction, and the end of the TE next to it
+    genome_flank: str = ""
+    te_flank: str = ""
+    # alignment score of the TE part against the TE consensus (with --verify)
+    te_score: Optional[float] = None
+    # the split read of the row, and the number of its copies and the libraries
+    # they are from (with --dedup)
+    read: Optional[SplitRead] = None
+    copies: int = 1
+    fastq_filenames: List[str] = field(default_factory=list)
+
+
+# SAM columns needed to parse a split read
+SPLIT_READ_COLUMNS = (QNAME, FLAG, RNAME, POS, CIGAR, SEQ)
+
+
+def parse_split_read(
+    read_name: str, flag: str, chrom: str, pos: str, cigar_string: str, seq: str
+) -> Optional[SplitRead]:
+    """Parse a genome alignment, if it is a split read whose genome and TE parts line up"""
+
+    # parse out genome alignment information
+    cigar = parse_cigar(cigar_string)
+    if is_right_clipped(cigar):
+        # genome part first, then the TE part
+        upstream = True
+        genome_match_size, genome_clip_size = cigar.aligned, cigar.right_clip
+    elif is_left_clipped(cigar):
+        # TE part first, then the genome part
+        upstream = False
+        genome_match_size, genome_clip_size = cigar.aligned, cigar.left_clip
+    else:
+        return None
+
+    if len(seq) != 150:
+        return None
+
+    # parse out TE alignment information
+    te_alignment_info = read_name.split("|")
+    te_name = te_alignment_info[1]
+    te_match_size = int(te_alignment_info[2])
+    te_clip_size = int(te_alignment_info[3])
+
+    if genome_match_size != te_clip_size or genome_clip_size != te_match_size:
+        return None
+
+    pos = int(pos)
+    junction = pos + cigar.ref_length - 1 if upstream else pos
+    return SplitRead(
+        te_name,
+        chrom,
+        pos,
+        seq,
+        upstream,
+        junction,
+        te_match_size,
+        fragment_name(read_name),
+        bool(int(flag) & 0x10),
+    )
 
-    # check that it is the same transposon
-    if res.name != tgt.te_name:
-        return False
 
-    # check that it is on the same chromosome
-    if res.chrom != tgt.chrom:
+def supports(read: SplitRead, result: Result) -> bool:
+    """Is the split read evidence for the (filtered) result?"""
+    if read.te_name != result.name:
         return False
+    if read.chrom != result.chrom:
+        return False
+    return (
+        abs(result.upstream_pos - read.pos) <= cutoff
+        or abs(result.downstream_pos - read.pos) <= cutoff
+    )
 
-    # check the position
-    if res.ref:
-        return tgt.pos in range(res.upstream_pos, res.downstream_pos + 1)
-    else:
-        return (
-            abs(res.upstream_pos - tgt.pos) <= cutoff
-            or abs(res.downstream_pos - tgt.pos) <= cutoff
-        )
-
-
-filtered: Dict[str, List[Result]] = {}
 
-for filename in results:
-    filtered[filename] = []
-    for tgt in targets:
-        tentative = [result for result in results[filename] if candidate(tgt, result)]
+def filter_results(
+    results: List[Result], selected_targets: Iterable[Target]
+) -> List[Tuple[Target, Result]]:
+    """Find the result corresponding to each target (if any)"""
+    filtered = []
+    index = ResultIndex(results)
+    for tgt in selected_targets:
+        tentative = candidates(tgt, index)
         if len(tentative) > 1:
             raise RuntimeError(
                 f"tentative insertion list has more than 1 element (target: {tgt})"
             )
         elif len(tentative) == 1:
-            tentative[0].target_name = tgt.name
-            tentative[0].te_name = tgt.te_name
-            filtered[filename].append(tentative[0])
+            filtered.append((tgt, tentative[0]))
+    return filtered
+
+
+class Flanks:
+    """Sequences next to the junction of split reads, from a reference and a TE set.
+
+    The genome flank is the reference sequence from `flank` bp before to `flank`
+    bp after the junction. The TE flank is the end of the TE consensus that is
+    joined to the genome: its start for upstream reads and its end for downstream
+    reads (i.e. assuming the insertion is in the same orientation as the
+    consensus).
+    """
+
+    def __init__(self, ref_path: Optional[str], transposons_path: Optional[str]):
+        self.ref = FastaFile(ref_path) if ref_path is not None else None
+        self.transposons = (
+            FastaFile(transposons_path) if transposons_path is not None else None
+        )
+
+    def genome(self, read: SplitRead) -> str:
+        if self.ref is None or read.chrom not in self.ref:
+            return ""
+        if read.upstream:
+            return self.ref.fetch(
+                read.chrom, read.junction - flank + 1, read.junction + flank
+            )
+        return self.ref.fetch(
+            read.chrom, read.junction - flank, read.junction + flank - 1
+        )
+
+    def te(self, read: SplitRead) -> str:
+        if self.transposons is None or read.te_name not in self.transposons:
+            return ""
+        if read.upstream:
+            return self.transposons.fetch(read.te_name, 1, flank)
+        length = self.transposons.length(read.te_name)
+        return self.transposons.fetch(read.te_name, length - flank + 1, length)
+
+    def close(self):
+        for fasta in (self.ref, self.transposons):
+            if fasta is not None:
+                fasta.close()
+
+
+def scan_rows(
+    filename: str,
+    selected_targets: Iterable[Target],
+    flanks: Flanks,
+) -> Iterator[Row]:
+    """Rows of the table for a single library, as the alignments are read"""
+    result_folder = result_folders_inv[filename]
+
+    def make_row(insertion_line: str, read: SplitRead) -> Row:
+        return Row(
+            filename,
+            insertion_line,
+            read.te_name,
+            read.sequence,
+            read.upstream,
+            flanks.genome(read),
+            flanks.te(read),
+            read=read,
+        )
+
+    filtered = filter_results(
+        load_results(f"{result_folder}/te_mapper_output.json"), selected_targets
+    )
+
+    print(f"processing genome alignments for file {filename} ...")
+    store_path = f"{result_folder}/genome_aligned.store"
+    if os.path.exists(store_path):
+        # only look at the alignments around each result
+        with AlignmentStore(store_path) as store:
+            for tgt, result in filtered:
+                for line in store.fetch(
+                    result.chrom,
+                    min(result.upstream_pos, result.downstream_pos) - cutoff,
+                    max(result.upstream_pos, result.downstream_pos) + cutoff,
+                ):
+                    read = parse_split_read(*split_fields(line, SPLIT_READ_COLUMNS))
+                    if read is not None and supports(read, result):
+                        yield make_row(tgt.name, read)
+    else:
+        # windows around each result, keyed by chromosome and TE name
+        windows: IntervalIndex[Tuple[int, Target]] = IntervalIndex()
+        for i, (tgt, result) in enumerate(filtered):
+            for pos in {result.upstream_pos, result.downstream_pos}:
+                windows.add(
+                    (result.chrom, result.name),
+                    pos - cutoff,
+                    pos + cutoff,
+                    (i, tgt),
+                )
+
+        for fields in read_sam(
+            f"{result_folder}/genome_aligned.sam", SPLIT_READ_COLUMNS
+        ):
+            read = parse_split_read(*fields)
+            if read is None:
+                continue
+            # a read can be near both positions of a result
+            found = dict(windows.containing((read.chrom, read.te_name), read.pos))
+            for i in sorted(found):
+                yield make_row(found[i].name, read)
+
+
+def iter_library_rows(
+    filename: str,
+    selected_targets: Iterable[Target] = targets,
+    ref_path: Optional[str] = None,
+    transposons_path: Optional[str] = None,
+    verify_path: Optional[str] = None,
+) -> Iterator[Row]:
+    """Rows of the table for a single library (and optionally only some targets)
+
+    With a reference and/or a TE set, the rows also get the sequences next to
+    the junction of each read. With a TE set to verify against, the TE part of
+    each read is aligned to the consensus of its TE, a batch of rows at a time.
+    """
+    flanks = Flanks(ref_path, transposons_path)
+    try:
+        rows = scan_rows(filename, selected_targets, flanks)
+        if verify_path is None:
+            yield from rows
+            return
+
+        verifier = Verifier(verify_path)
+        try:
+            while True:
+                batch = list(islice(rows, VERIFY_BATCH))
+                if not batch:
+                    break
+                scores = verifier.scores(
+                    [(row.read.te_name, row.read.te_part()) for row in batch]
+                )
+                for row, score in zip(batch, scores):
+                    row.te_score = float(score)
+                yield from batch
+        finally:
+            verifier.close()
+    finally:
+        flanks.close()
+
+
+def library_rows(
+    filename: str,
+    selected_targets: Iterable[Target] = targets,
+    ref_path: Optional[str] = None,
+    transposons_path: Optional[str] = None,
+    verify_path: Optional[str] = None,
+) -> List[Row]:
+    """All the rows of iter_library_rows (e.g. to send back from a worker process)"""
+    # the libraries of one run can be in worker processes, so each reports itself
+    with stage("sequence_table_library", filename.split(".")[0]):
+        return list(
+            iter_library_rows(
+                filename, selected_targets, ref_path, transposons_path, verify_path
+            )
+        )
 
 
 @dataclass
-class Row:
-    fastq_filename: str
+class TubeSupport:
+    tube: str
     insertion_line: str
-    natural_te: str
-    sequence: str
     upstream: bool
+    # split reads in each mate
+    r1_reads: int = 0
+    r2_reads: int = 0
+    # fragments with a split read in either mate, and in both
+    fragments: int = 0
+    both_mates: int = 0
+
+
+def tube_support(
+    tube_name: str, r1_rows: List[Row], r2_rows: List[Row]
+) -> List[TubeSupport]:
+    """Support for each insertion line and end in a tube, joining the mates by read name"""
+    support: Dict[Tuple[str, bool], TubeSupport] = {}
+    for _, r1, r2 in hash_join(
+        ((row.read.fragment, (row.insertion_line, row.upstream)) for row in r1_rows),
+        ((row.read.fragment, (row.insertion_line, row.upstream)) for row in r2_rows),
+    ):
+        for key in set(r1) | set(r2):
+            if key not in support:
+                support[key] = TubeSupport(tube_name, *key)
+            counts = support[key]
+            counts.r1_reads += r1.count(key)
+            counts.r2_reads += r2.count(key)
+            counts.fragments += 1
+            counts.both_mates += key in r1 and key in r2
+    return [
+        support[key] for key in sorted(support, key=lambda key: (key[0], not key[1]))
+    ]
+
+
+def tube_rows(
+    tube_name: str,
+    ref_path: Optional[str] = None,
+    transposons_path: Optional[str] = None,
+    verify_path: Optional[str] = None,
+) -> Tuple[List[Row], List[TubeSupport]]:
+    """Rows of the table for both libraries of a tube, and the support in the tube"""
+    r1_rows, r2_rows = (
+        library_rows(
+            f"{library}.fastq", targets, ref_path, transposons_path, verify_path
+        )
+        for library in libraries(tube_name)
+    )
+    return r1_rows + r2_rows, tube_support(tube_name, r1_rows, r2_rows)
 
 
-rows: List[Row] = []
+TUBE_SUPPORT_COLUMNS = [
+    "Tube",
+    "Insertion Line Name",
+    "Match End",
+    "R1 Reads",
+    "R2 Reads",
+    "Fragments",
+    "Both Mates",
+]
 
-upstream_regex = re.compile(r"(\d+)M(\d+)(S|H)")
-downstream_regex = re.compile(f"(\d+)(S|H)(\d+)M")
 
-for filename in filtered:
-    print(f"processing genome alignments for file {filename} ...")
-    with open(
-        f"{result_folders_inv[filename]}/genome_aligned.sam", "r"
-    ) as genome_aligned_file:
-        alignments = genome_aligned_file.read().splitlines()
-        alignments = [line for line in alignments if not line.startswith("@")]
-    for line in alignments:
-        sam_fields = line.split("\t")
-
-        # parse out genome alignment information
-        cigar_string = sam_fields[5]
-        upstream_match = upstream_regex.fullmatch(cigar_string)
-        downstream_match = downstream_regex.fullmatch(cigar_string)
-        if upstream_match is None and downstream_match is None:
-            continue
-
-        chrom = sam_fields[2]
-        pos = int(sam_fields[3])
-        seq = sam_fields[9]
-        if len(seq) != 150:
-            continue
-
-        if upstream_match is not None:
-            upstream = True
-            genome_match_size, genome_clip_size = upstream_match.group(1, 2)
+def write_tube_support(path: str, support: Iterable[TubeSupport]):
+    with open_table(path, TUBE_SUPPORT_COLUMNS) as table:
+        for counts in support:
+            table.write(
+                [
+                    counts.tube,
+                    counts.insertion_line,
+                    "Upstream" if counts.upstream else "Downstream",
+                    counts.r1_reads,
+                    counts.r2_reads,
+                    counts.fragments,
+                    counts.both_mates,
+                ]
+            )
+
+
+def deduplicate(rows: Iterable[Row]) -> List[Row]:
+    """Collapse the rows of each fragment into the first one, counting the copies
+
+    Rows are copies of the same fragment if they are from the same tube (so R1
+    and R2 reads are collapsed too) and insertion line, and their reads are
+    aligned at the same position and strand with the same end and canonical
+    sequence. The libraries of the copies are kept in fastq_filenames.
+    """
+    unique: Dict[tuple, Row] = {}
+    for row in rows:
+        read = row.read
+        key = (
+            tube(row.fastq_filename),
+            row.insertion_line,
+            read.chrom,
+            read.pos,
+            read.reverse,
+            read.upstream,
+            sequence_hash(read.sequence),
+        )
+        filenames = row.fastq_filenames or [row.fastq_filename]
+        if key in unique:
+            first = unique[key]
+            first.copies += row.copies
+            first.fastq_filenames += [
+                filename
+                for filename in filenames
+                if filename not in first.fastq_filenames
+            ]
         else:
-            upstream = False
-            genome_match_size, genome_clip_size = downstream_match.group(3, 1)
-        genome_match_size = int(genome_match_size)
-        genome_clip_size = int(genome_clip_size)
-
-        # parse out TE alignment information
-        te_alignment_info = sam_fields[0].split("|")
-        te_name = te_alignment_info[1]
-        te_match_size = int(te_alignment_info[2])
-        te_clip_size = int(te_alignment_info[3])
-
-        if genome_match_size != te_clip_size or genome_clip_size != te_match_size:
-            continue
-
-        for result in filtered[filename]:
-            if te_name != result.te_name:
-                continue
-            if chrom != result.chrom:
-                continue
-            if (
-                abs(result.upstream_pos - pos) > cutoff
-                and abs(result.downstream_pos - pos) > cutoff
-            ):
-                continue
-            rows.append(Row(filename, result.target_name, te_name, seq, upstream))
+            unique[key] = replace(row, fastq_filenames=list(filenames))
+    return list(unique.values())
 
-with open("output/te_mapper/split_read_sequence_table.csv", "w") as out_file:
-    out_file.write(
-        "FASTQ File Name,Insertion Line Name,Natural TE,Match End,Sequence\n"
-    )
+
+@dataclass
+class Junction:
+    insertion_line: str
+    natural_te: str
+    upstream: bool
+    chrom: str
+    pos: int
+    # reads (including duplicates) and distinct fragments at the junction
+    reads: int
+    fragments: int
+    # consensus of the fragments, and the index of its first base after the junction
+    consensus: str
+    split: int
+
+
+def junctions(rows: Iterable[Row]) -> List[Junction]:
+    """Consensus of the (deduplicated) rows at each junction, in order of first row"""
+    groups: Dict[tuple, List[Row]] = {}
     for row in rows:
-        out_file.write(
-            f"{row.fastq_filename},{row.insertion_line},{row.natural_te},{'Upstream' if row.upstream else 'Downstream'},{row.sequence}\n"
+        key = (
+            row.insertion_line,
+            row.natural_te,
+            row.upstream,
+            row.read.chrom,
+            row.read.junction,
+        )
+        groups.setdefault(key, []).append(row)
+    return [
+        Junction(
+            *key,
+            sum(row.copies for row in group),
+            len(group),
+            *consensus([(row.read.sequence, row.read.split()) for row in group]),
         )
+        for key, group in groups.items()
+    ]
+
+
+JUNCTION_COLUMNS = [
+    "Insertion Line Name",
+    "Natural TE",
+    "Match End",
+    "Chromosome",
+    "Junction",
+    "Reads",
+    "Fragments",
+    "Consensus",
+    "Split",
+]
+
+
+def write_junctions(path: str, junctions: Iterable[Junction]):
+    with open_table(path, JUNCTION_COLUMNS) as table:
+        for junction in junctions:
+            table.write(
+                [
+                    junction.insertion_line,
+                    junction.natural_te,
+                    "Upstream" if junction.upstream else "Downstream",
+                    junction.chrom,
+                    junction.pos,
+                    junction.reads,
+                    junction.fragments,
+                    junction.consensus,
+                    junction.split,
+                ]
+            )
+
+
+COLUMNS = [
+    "FASTQ File Name",
+    "Insertion Line Name",
+    "Natural TE",
+    "Match End",
+    "Sequence",
+]
+
+
+def columns(
+    with_flanks: bool = False, with_scores: bool = False, with_copies: bool = False
+) -> List[str]:
+    names = list(COLUMNS)
+    if with_flanks:
+        names += ["Genome Flank", "TE Flank"]
+    if with_scores:
+        names += ["TE Score", "Verified"]
+    if with_copies:
+        names += ["Copies", "FASTQ File Names"]
+    return names
+
+
+def row_values(
+    row: Row,
+    with_flanks: bool = False,
+    with_scores: bool = False,
+    with_copies: bool = False,
+) -> list:
+    values = [
+        row.fastq_filename,
+        row.insertion_line,
+        row.natural_te,
+        "Upstream" if row.upstream else "Downstream",
+        row.sequence,
+    ]
+    if with_flanks:
+        values += [row.genome_flank, row.te_flank]
+    if with_scores:
+        verified = "yes" if row.te_score >= MIN_SCORE else "no"
+        values += [f"{row.te_score:.3f}", verified]
+    if with_copies:
+        # the libraries of all copies (R1 and R2 of a tube), e.g. a;b
+        values += [row.copies, ";".join(row.fastq_filenames)]
+    return values
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="make the split read sequence table for all libraries"
+    )
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        default=1,
+        help="number of libraries to process in parallel",
+    )
+    parser.add_argument(
+        "--rows",
+        nargs=3,
+        metavar=("FASTQ_FILE_NAME", "TARGET", "OUT"),
+        help="only write the rows (without header) for one library and target (used by pipeline.py)",
+    )
+    parser.add_argument(
+        "--ref",
+        metavar="FASTA",
+        help="reference genome, to add the genome sequence around each junction",
+    )
+    parser.add_argument(
+        "--transposons",
+        metavar="FASTA",
+        help="TE consensus sequences, to add the end of the TE at each junction",
+    )
+    parser.add_argument(
+        "--verify",
+        metavar="FASTA",
+        help="TE consensus sequences (e.g. the transposon set or sx4.fa) to align "
+        "the TE part of each read to",
+    )
+    parser.add_argument(
+        "--dedup",
+        action="store_true",
+        help="collapse duplicate reads (with Copies and FASTQ File Names columns) and "
+        "write the consensus of each junction to "
+        "output/te_mapper/split_read_junctions.csv",
+    )
+    parser.add_argument(
+        "--paired",
+        action="store_true",
+        help="process the R1 and R2 libraries of each tube together, and write the "
+        "support in each tube to output/te_mapper/split_read_tube_support.csv",
+    )
+    parser.add_argument(
+        "--format",
+        choices=("csv", "parquet"),
+        default="csv",
+        help="format of the table (parquet needs pyarrow)",
+    )
+    args = parser.parse_args()
+    profile_script(args.rows[0] if args.rows is not None else None)
+    with_flanks = args.ref is not None or args.transposons is not None
+    with_scores = args.verify is not None
+    # index the FASTA files once, before the libraries open them (maybe in parallel)
+    for fasta_path in (args.ref, args.transposons, args.verify):
+        if fasta_path is not None:
+            ensure_fai(fasta_path)
+
+    if args.rows is not None:
+        if args.dedup or args.paired:
+            parser.error("--dedup and --paired need all libraries (not --rows)")
+        filename, target_name, out_path = args.rows
+        if target_name not in {tgt.name for tgt in targets}:
+            raise ValueError(f"unknown target: {target_name}")
+        rows = iter_library_rows(
+            filename,
+            [targets.get(target_name)],
+            args.ref,
+            args.transposons,
+            args.verify,
+        )
+        with open_table(
+            out_path, columns(with_flanks, with_scores), header=False
+        ) as table:
+            for row in rows:
+                table.write(row_values(row, with_flanks, with_scores))
+        return
+
+    if args.paired:
+        # one job per tube, in library order
+        jobs = TUBES
+        run = tube_rows
+    else:
+        jobs = list(result_folders_inv)
+        # rows are streamed from a single process, or sent back a library at a time
+        # (only these report a stage per library: a streamed library is read
+        # while the table is written)
+        run = library_rows if args.jobs > 1 else iter_library_rows
+    rows_for = partial(
+        run,
+        ref_path=args.ref,
+        transposons_path=args.transposons,
+        verify_path=args.verify,
+    )
+    support: List[TubeSupport] = []
+
+    def rows_of(output) -> Iterable[Row]:
+        if args.paired:
+            rows, tube_counts = output
+            support.extend(tube_counts)
+            return rows
+        return output
+
+    def all_rows() -> Iterator[Row]:
+        """The rows of all jobs, written out as they come"""
+        if args.jobs > 1:
+            # map returns the rows in library order, whichever library finishes first
+            with ProcessPoolExecutor(max_workers=args.jobs) as pool:
+                for output in pool.map(rows_for, jobs):
+                    yield from rows_of(output)
+        else:
+            for job in jobs:
+                yield from rows_of(rows_for(job))
+
+    rows: Iterable[Row] = all_rows()
+    if args.dedup:
+        # duplicates can be in different libraries (R1 and R2 of a tube)
+        rows = deduplicate(rows)
+        write_junctions("output/te_mapper/split_read_junctions.csv", junctions(rows))
+
+    table_path = f"output/te_mapper/split_read_sequence_table.{args.format}"
+    with open_table(table_path, columns(with_flanks, with_scores, args.dedup)) as table:
+        for row in rows:
+            table.write(row_values(row, with_flanks, with_scores, args.dedup))
+
+    if args.paired:
+        write_tube_support("output/te_mapper/split_read_tube_support.csv", support)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,9 +1,17 @@
-import re
 import sys
 from dataclasses import dataclass
-from typing import List, Tuple
+from typing import Tuple
+
+from cigar import is_right_clipped, parse_cigars
+from profiling import profile_script
+from sam import CIGAR, read_sam
+from tables import SPLIT_READS_TABLE_COLUMNS, open_table
+from target_registry import load_targets
 
 result_folder_name = sys.argv[1]
+profile_script(result_folder_name)
+
+target = load_targets().get("SX4Et51")
 
 
 @dataclass
@@ -12,52 +20,38 @@ class UpstreamTEAlignment:
     genome_range: Tuple[int, int]
 
 
-with open(f"output/te_mapper/{result_folder_name}/sx4et51_reads.txt", "r") as in_file:
-    alignments: List[UpstreamTEAlignment] = []
-    for line in in_file.readlines():
-        fields = line.split("\t")
-        cigar_string = fields[5]
-        expr = re.compile(r"(\d+)M(\d+)(S|H)")
-        matches = expr.fullmatch(cigar_string)
-        if matches is None:
-            continue
-        genome_range_size, te_range_size = matches.group(1, 2)
-        te_range_size = int(te_range_size)
-        genome_range_size = int(genome_range_size)
-        alignments.append(
-            UpstreamTEAlignment(
-                (genome_range_size + 1, genome_range_size + te_range_size),
-                (1, genome_range_size),
-            )
-        )
-
-with open(f"output/te_mapper/{result_folder_name}/sx4et51_reads.csv", "w") as out_file:
-    out_file.write(
-        "Name,"
-        "TE Name,"
-        "Chromosome,"
-        "Upstream Position,"
-        "Downstream Position,"
-        "Orientation,"
-        "Reference?,"
-        "Upstream Reads (TE Range),,"
-        "Upstream Reads (Genome Range),,"
-        "Downstream Reads (TE Range),,"
-        "Downstream Reads (Genome Range),\n"
+cigar_strings = [
+    cigar_string
+    for (cigar_string,) in read_sam(
+        f"output/te_mapper/{result_folder_name}/sx4et51_reads.txt", (CIGAR,)
     )
-    out_file.write(
-        "SX4Et51,"
-        "copia#LTR/Copia,"
-        "2R,"
-        "9237984,"
-        ","
-        "+/+,"
-        "non-reference,"
-        ",,,,,,,\n"
+]
+with open_table(
+    f"output/te_mapper/{result_folder_name}/sx4et51_reads.csv",
+    SPLIT_READS_TABLE_COLUMNS,
+) as table:
+    table.write(
+        [
+            target.name,
+            target.te_name,
+            target.chrom,
+            target.pos,
+            "",
+            "+/+",
+            "non-reference",
+        ]
+        + [""] * 8
     )
-    for alignment in alignments:
-        out_file.write(",,,,,,,")
-        out_file.write(
-            f"{alignment.te_range[0]},{alignment.te_range[1]},{alignment.genome_range[0]},{alignment.genome_range[1]},"
+    for cigar in parse_cigars(cigar_strings):
+        # upstream reads: genome part first, then the (clipped) TE part
+        if not is_right_clipped(cigar):
+            continue
+        genome_range_size = cigar.aligned
+        te_range_size = cigar.right_clip
+        alignment = UpstreamTEAlignment(
+            (genome_range_size + 1, genome_range_size + te_range_size),
+            (1, genome_range_size),
+        )
+        table.write(
+            [""] * 7 + [*alignment.te_range, *alignment.genome_range] + [""] * 4
         )
-        out_file.write(",,,\n")
@@ -1,29 +1,14 @@
-import json
-import sys
+import argparse
+from concurrent.futures import ProcessPoolExecutor
 from dataclasses import dataclass
-from typing import List, Optional, Tuple
+from functools import lru_cache
+from typing import Dict, List, Optional, Tuple
 
-from PIL import Image, ImageDraw
-
-result_folder_name = sys.argv[1]
-
-
-@dataclass
-class SplitReadRanges:
-    te_range: List[int]
-    genome_range: List[int]
-
-
-@dataclass
-class Result:
-    ref: bool
-    name: str
-    chrom: str
-    upstream_pos: int
-    downstream_pos: int
-    orientation: str
-    upstream_reads: List[SplitReadRanges]
-    downstream_reads: List[SplitReadRanges]
+from diagrams import Diagram, insertion_diagram, save, tile
+from pairs import LIBRARIES
+from profiling import profile_script
+from results import Result, load_results
+from target_registry import load_targets
 
 
 @dataclass
@@ -31,160 +16,125 @@ class Target:
     name: str
     upstream_pos: int
     length: Optional[int] = None
-    result: Optional[Result] = None
 
 
+# the insertion calls to draw (by upstream position), and the length of the natural TE
 targets = [
-    Target("SX4Ch7", 12_004_481, 3409),
-    Target("SX4Aq839", 16_727_569, 3409),
-    Target("SX4Et8", 15_951_006, 7062),
+    Target(tgt.name, tgt.call_pos, tgt.te_length)
+    for tgt in load_targets().group("figures")
 ]
 
 
-def get_results() -> List[Result]:
-    with open(
-        f"output/te_mapper/{result_folder_name}/te_mapper_output.json", "r"
-    ) as in_file:
-        raw = json.load(in_file)
-        reads = []
-        for chrom in raw:
-            for read in chrom["non_reference"]:
-                reads.append(Result(False, **read))
-            for read in chrom["reference"]:
-                reads.append(Result(True, **read))
-        for read in reads:
-            read.upstream_reads = [SplitReadRanges(**x) for x in read.upstream_reads]
-            read.downstream_reads = [
-                SplitReadRanges(**x) for x in read.downstream_reads
-            ]
-        return reads
-
-
-def filter_results(results: List[Result]):
-    for target in targets:
-        found = False
-        for result in results:
-            if result.upstream_pos == target.upstream_pos:
-                found = True
-                target.result = result
-                break
-        if not found:
-            print(f"library {sys.argv[1]}: insertion {target.name} not found")
-
-
-IMAGE_HEIGHT_MARGIN_EACH_SIDE = 100
-IMAGE_WIDTH_MARGIN_EACH_SIDE = 200
-NT_PER_PIXEL = 1
-BAR_HEIGHT = 5
-BAR_SPACING = 3
-INSERTION_COLOR = (0, 0, 255)
-TE_PART_COLOR = (0, 255, 0)
-GENOME_PART_COLOR = (255, 0, 0)
-
-
-def draw_single_insertion(
-    target: Target, draw: ImageDraw, lower_left_pos: Tuple[int, int]
-):
+@lru_cache(maxsize=None)
+def get_results(library: str) -> Dict[int, Result]:
+    """Results of a library by upstream position (loaded once per process)."""
+    results: Dict[int, Result] = {}
+    for result in load_results(f"output/te_mapper/{library}/te_mapper_output.json"):
+        # the first result at a position wins
+        results.setdefault(result.upstream_pos, result)
+    return results
+
+
+def target_diagram(library: str, target: Target) -> Optional[Diagram]:
+    """Diagram of a target in a library (None if the insertion was not found)."""
+    result = get_results(library).get(target.upstream_pos)
+    if result is None:
+        print(f"library {library}: insertion {target.name} not found")
+        return None
     insertion_size = (
         target.length
         if target.length is not None
-        else target.result.downstream_pos - target.result.upstream_pos + 1
+        else result.downstream_pos - result.upstream_pos + 1
     )
 
-    insertion = target.result
+    # sort the upstream and downstream reads to get the V shape
+    result.upstream_reads.sort_by("te_start")
+    result.downstream_reads.sort_by("te_end", reverse=True)
 
-    # sort the upstream and downstream reads to get the V shape when we iterate through them
-    insertion.upstream_reads.sort(key=lambda x: x.te_range[0])
-    insertion.downstream_reads.sort(key=lambda y: y.te_range[1], reverse=True)
-
-    # draw transposon
-    draw.rectangle(
-        [
-            (lower_left_pos[0], lower_left_pos[1]),
-            (lower_left_pos[0] + insertion_size, lower_left_pos[1] - BAR_HEIGHT),
-        ],
-        fill=INSERTION_COLOR,
+    return insertion_diagram(
+        insertion_size, result.upstream_reads, result.downstream_reads
     )
 
-    # draw upstream reads
-    cursor = (lower_left_pos[0], lower_left_pos[1])
-    for read in insertion.upstream_reads:
-        cursor = (cursor[0], cursor[1] - BAR_HEIGHT - BAR_SPACING)
-        draw.rectangle(
-            [
-                (
-                    cursor[0] - (read.genome_range[1] - read.genome_range[0]) + 1,
-                    cursor[1],
-                ),
-                (cursor[0], cursor[1] - BAR_HEIGHT),
-            ],
-            fill=GENOME_PART_COLOR,
-        )
-        draw.rectangle(
-            [
-                (cursor[0], cursor[1]),
-                (
-                    cursor[0] + read.te_range[1] - read.te_range[0] + 1,
-                    cursor[1] - BAR_HEIGHT,
-                ),
-            ],
-            fill=TE_PART_COLOR,
-        )
 
-    # draw downstream reads
-    cursor = (lower_left_pos[0] + insertion_size, lower_left_pos[1])
-    for read in insertion.downstream_reads:
-        cursor = (cursor[0], cursor[1] - BAR_HEIGHT - BAR_SPACING)
-        draw.rectangle(
-            [
-                (
-                    cursor[0] - (read.te_range[1] - read.te_range[0]) + 1,
-                    cursor[1],
-                ),
-                (cursor[0], cursor[1] - BAR_HEIGHT),
-            ],
-            fill=TE_PART_COLOR,
-        )
-        draw.rectangle(
-            [
-                (cursor[0], cursor[1]),
-                (
-                    cursor[0] + read.genome_range[1] - read.genome_range[0] + 1,
-                    cursor[1] - BAR_HEIGHT,
-                ),
-            ],
-            fill=GENOME_PART_COLOR,
-        )
+def library_diagrams(library: str) -> List[Optional[Diagram]]:
+    return [target_diagram(library, target) for target in targets]
+
+
+def render(job: Tuple[str, Target, str]) -> Optional[str]:
+    """Render a single (library, target) figure; its path (None if not found)."""
+    library, target, fmt = job
+    diagram = target_diagram(library, target)
+    if diagram is None:
+        return None
+    path = f"output/te_mapper/{library}/figure_{target.name}.{fmt}"
+    save(diagram, path)
+    return path
+
+
+def figure_list_path(library: str) -> str:
+    """List of the figures rendered for a library (an output for pipeline.py)."""
+    return f"output/te_mapper/{library}/figures.txt"
 
 
 def main():
-    filter_results(get_results())
-    for target in targets:
-        if target.result is None:
-            continue
-        result = target.result
-        insertion_size = (
-            target.length
-            if target.length is not None
-            else target.result.downstream_pos - target.result.upstream_pos + 1
-        )
-        image_width = insertion_size + 2 * IMAGE_WIDTH_MARGIN_EACH_SIDE
-        image_height = (
-            BAR_HEIGHT
-            + max(len(result.upstream_reads), len(result.downstream_reads))
-            * (BAR_HEIGHT + BAR_SPACING)
-            + 2 * IMAGE_HEIGHT_MARGIN_EACH_SIDE
-        )
-        image = Image.new("RGB", (image_width, image_height), (255, 255, 255))
-        draw_single_insertion(
-            target,
-            ImageDraw.Draw(image),
-            (
-                IMAGE_WIDTH_MARGIN_EACH_SIDE,
-                image_height - IMAGE_HEIGHT_MARGIN_EACH_SIDE,
-            ),
+    parser = argparse.ArgumentParser(
+        description="draw the split reads of the table 1 insertions"
+    )
+    parser.add_argument(
+        "libraries",
+        nargs="*",
+        default=LIBRARIES,
+        help="libraries to draw (default: all)",
+    )
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        default=1,
+        help="number of figures to render in parallel",
+    )
+    parser.add_argument(
+        "--format", choices=["png", "svg"], default="png", help="output format"
+    )
+    parser.add_argument(
+        "--tile",
+        metavar="OUT",
+        help="draw all the (library, target) figures into a single tiled figure",
+    )
+    args = parser.parse_args()
+    profile_script()
+
+    if args.tile is not None:
+        # one row per library, one column per target
+        if args.jobs > 1:
+            with ProcessPoolExecutor(max_workers=args.jobs) as pool:
+                rows = list(pool.map(library_diagrams, args.libraries))
+        else:
+            rows = [library_diagrams(library) for library in args.libraries]
+        save(
+            tile([diagram for row in rows for diagram in row], len(targets)), args.tile
         )
-        image.save(f"output/te_mapper/{result_folder_name}/figure_{target.name}.png")
+        return
+
+    # jobs of a library are handed out together (chunksize), so each worker loads
+    # a library's results once
+    jobs = [
+        (library, target, args.format)
+        for library in args.libraries
+        for target in targets
+    ]
+    if args.jobs > 1:
+        with ProcessPoolExecutor(max_workers=args.jobs) as pool:
+            paths = list(pool.map(render, jobs, chunksize=len(targets)))
+    else:
+        paths = [render(job) for job in jobs]
+
+    # which figures exist depends on which insertions were found
+    for library in args.libraries:
+        with open(figure_list_path(library), "w") as out_file:
+            for (job_library, _, _), path in zip(jobs, paths):
+                if job_library == library and path is not None:
+                    out_file.write(f"{path}\n")
 
 
 if __name__ == "__main__":
@@ -0,0 +1,128 @@
+"""joining the two mates of a tube by read name
+
+Each tube was sequenced as two libraries, <tube>_R1_001 and <tube>_R2_001, whose
+reads are the two ends of the same fragments and have the same name. Evidence
+from both mates is combined with a hash join on the read name.
+
+The join holds both sides in a hash table while they fit in max_items items.
+Past that, everything is hash-partitioned into spill files on disk (a Grace
+hash join) and the partitions are joined one at a time; a partition that is
+still too big is partitioned again with a different hash, so memory stays
+bounded by max_items (unless a single read name has more items than that).
+"""
+
+import os
+import pickle
+import tempfile
+import zlib
+from itertools import chain
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple, TypeVar
+
+T = TypeVar("T")
+
+# items held in memory by a join before it spills to disk
+MAX_ITEMS = 1 << 20
+
+# spill files per level of partitioning, and levels before giving up on splitting
+PARTITIONS = 64
+MAX_LEVELS = 4
+
+
+def libraries(tube: str) -> Tuple[str, str]:
+    """The R1 and R2 libraries of a tube (e.g. 7 -> 7_R1_001, 7_R2_001)."""
+    return f"{tube}_R1_001", f"{tube}_R2_001"
+
+
+# the tubes that were sequenced, and all their libraries (in this order everywhere)
+TUBES = ["1", "2", "7", "8"]
+LIBRARIES = [library for tube_name in TUBES for library in libraries(tube_name)]
+
+
+def tube(library: str) -> str:
+    """The tube a library is from (e.g. 7_R1_001 or 7_R1_001.fastq -> 7)."""
+    return library.split("_R")[0]
+
+
+def fragment_name(qname: str) -> str:
+    """Name of the fragment a read is from.
+
+    te_mapper appends "|<TE>|<match>|<clip>" to the name, and some tools add /1
+    or /2 for the mate.
+    """
+    name = qname.split("|", 1)[0]
+    if name.endswith(("/1", "/2")):
+        name = name[:-2]
+    return name
+
+
+def _partition(name: str, level: int) -> int:
+    return zlib.crc32(f"{level}:{name}".encode()) % PARTITIONS
+
+
+def _spill(sides: Iterable[Tuple[int, str, T]], tmp_dir: str, level: int) -> List[str]:
+    """Write (side, name, item) records to one spill file per partition."""
+    paths = [os.path.join(tmp_dir, f"{level}_{i}.pickle") for i in range(PARTITIONS)]
+    files = [open(path, "wb") for path in paths]
+    try:
+        for record in sides:
+            pickle.dump(record, files[_partition(record[1], level)])
+    finally:
+        for spill_file in files:
+            spill_file.close()
+    return paths
+
+
+def _read_spill(path: str) -> Iterator[Tuple[int, str, T]]:
+    with open(path, "rb") as spill_file:
+        while True:
+            try:
+                yield pickle.load(spill_file)
+            except EOFError:
+                return
+
+
+def _join(
+    sides: Iterator[Tuple[int, str, T]], max_items: int, tmp_dir: str, level: int
+) -> Iterator[Tuple[str, List[T], List[T]]]:
+    table: Dict[str, Tuple[List[T], List[T]]] = {}
+    count = 0
+    for side, name, item in sides:
+        table.setdefault(name, ([], []))[side].append(item)
+        count += 1
+        if count >= max_items and level < MAX_LEVELS:
+            break
+    else:
+        for name, (r1, r2) in table.items():
+            yield name, r1, r2
+        return
+
+    # too big: partition what is in memory and the rest of the input
+    held = (
+        (side, name, item)
+        for name, items in table.items()
+        for side in (0, 1)
+        for item in items[side]
+    )
+    paths = _spill(chain(held, sides), tmp_dir, level)
+    table.clear()
+    for path in paths:
+        yield from _join(_read_spill(path), max_items, tmp_dir, level + 1)
+        os.remove(path)
+
+
+def hash_join(
+    r1: Iterable[Tuple[str, T]],
+    r2: Iterable[Tuple[str, T]],
+    max_items: int = MAX_ITEMS,
+    tmp_dir: Optional[str] = None,
+) -> Iterator[Tuple[str, List[T], List[T]]]:
+    """Full outer join of the (read name, item) pairs of the two mates.
+
+    Yields (read name, R1 items, R2 items) once for every read name, in no
+    particular order.
+    """
+    sides = chain(
+        ((0, name, item) for name, item in r1), ((1, name, item) for name, item in r2)
+    )
+    with tempfile.TemporaryDirectory(dir=tmp_dir) as spill_dir:
+        yield from _join(sides, max_items, spill_dir, 0)
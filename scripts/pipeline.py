@@ -0,0 +1,371 @@
+"""incremental driver for the Python stages of the pipeline
+
+Every unit of work (one library, or one library and target) records a hash of
+everything it is built from in a manifest: the source of its script and of the
+local modules the script imports, its parameters, and the content of its input
+files. A unit is only re-run when that hash changes or one of its outputs is
+missing, so e.g. editing one target only recomputes the rows for that target.
+
+The alignment steps (sx map, bwa mem) and the fast_coverage statistics are still
+run by the Makefile; their outputs are the inputs of this pipeline.
+
+With --profile, the resource usage of every unit (and of the scripts inside
+them) is appended to a report, see profiling.py.
+
+usage: python3 scripts/pipeline.py [-j JOBS] [--dry-run] [--profile REPORT] [LIBRARY ...]
+"""
+
+import argparse
+import ast
+import hashlib
+import json
+import os
+import subprocess
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Set, Tuple
+
+import make_split_read_sequence_table as sequence_table
+from pairs import LIBRARIES
+from profiling import REPORT_ENV, run_command, stage
+from tables import open_table
+
+SCRIPTS_DIR = os.path.dirname(os.path.abspath(__file__))
+
+MANIFEST_PATH = "output/pipeline_manifest.json"
+TARGETS_PATH = "targets.csv"
+
+
+class Manifest:
+    """Hashes of the inputs each unit was last built from.
+
+    File hashes are cached by (size, modification time), so an unchanged
+    multi-GB input is only read once.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        try:
+            with open(path, "r") as in_file:
+                raw = json.load(in_file)
+        except FileNotFoundError:
+            raw = {}
+        self.files: Dict[str, list] = raw.get("files", {})
+        self.units: Dict[str, str] = raw.get("units", {})
+
+    def file_hash(self, path: str) -> str:
+        stat = os.stat(path)
+        cached = self.files.get(path)
+        if cached is not None and cached[:2] == [stat.st_size, stat.st_mtime_ns]:
+            return cached[2]
+        digest = hashlib.sha256()
+        with open(path, "rb") as in_file:
+            for chunk in iter(lambda: in_file.read(1 << 20), b""):
+                digest.update(chunk)
+        self.files[path] = [stat.st_size, stat.st_mtime_ns, digest.hexdigest()]
+        return digest.hexdigest()
+
+    def save(self):
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w") as out_file:
+            json.dump({"files": self.files, "units": self.units}, out_file, indent=1)
+        os.replace(tmp_path, self.path)
+
+
+def _local_imports(tree: ast.Module) -> Set[str]:
+    """Paths of the modules in scripts/ imported in a parsed script."""
+    names = set()
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Import):
+            names.update(alias.name for alias in node.names)
+        elif isinstance(node, ast.ImportFrom) and node.module is not None:
+            names.add(node.module)
+    paths = {os.path.join(SCRIPTS_DIR, f"{name}.py") for name in names}
+    return {path for path in paths if os.path.exists(path)}
+
+
+def source_hash(script: str) -> str:
+    """Hash of a script and of all the local modules it (transitively) imports.
+
+    Formatting and comments do not change the hash.
+    """
+    digest = hashlib.sha256()
+    root = os.path.join(SCRIPTS_DIR, script)
+    todo = [root]
+    seen: Set[str] = set()
+    while todo:
+        path = todo.pop()
+        if path in seen:
+            continue
+        seen.add(path)
+        with open(path, "r") as in_file:
+            tree = ast.parse(in_file.read())
+        todo.extend(sorted(_local_imports(tree)))
+        digest.update(os.path.basename(path).encode())
+        digest.update(ast.dump(tree).encode())
+    return digest.hexdigest()
+
+
+@dataclass
+class Unit:
+    # unique name, used as the key in the manifest
+    name: str
+    # script that builds the outputs
+    script: str
+    args: List[str]
+    inputs: List[str]
+    outputs: List[str]
+    # unit-specific parameters that are not in an input file (e.g. a single target)
+    parameters: str = ""
+    # output listing more outputs, for units whose outputs depend on the data
+    output_list: Optional[str] = None
+
+    def listed_outputs(self) -> List[str]:
+        """The outputs named in the output list (none if it is missing)."""
+        if self.output_list is None or not os.path.exists(self.output_list):
+            return []
+        with open(self.output_list, "r") as in_file:
+            return [line.rstrip("\n") for line in in_file if line.strip()]
+
+    def run(self):
+        # unit names are <stage>/<library>[/<target>]; the script run by the unit
+        # reports itself under its own name
+        stage_name, library = (self.name.split("/") + [""])[:2]
+        command = [sys.executable, os.path.join(SCRIPTS_DIR, self.script), *self.args]
+        returncode = run_command(f"unit/{stage_name}", command, library, self.inputs)
+        if returncode != 0:
+            raise subprocess.CalledProcessError(returncode, command)
+
+
+def library_units(library: str) -> List[List[Unit]]:
+    """Units for a single library, grouped into stages that have to run in order."""
+    te_mapper = f"output/te_mapper/{library}"
+    bwa_genome = f"output/bwa_genome/{library}"
+    te_mapper_json = f"{te_mapper}/te_mapper_output.json"
+
+    stores = [
+        Unit(
+            f"alignment_store/{folder}",
+            "alignment_store.py",
+            [f"{folder}/genome_aligned.sam", f"{folder}/genome_aligned.store"],
+            [f"{folder}/genome_aligned.sam"],
+            [f"{folder}/genome_aligned.store"],
+        )
+        for folder in (te_mapper, bwa_genome)
+    ]
+
+    extraction = [
+        Unit(
+            f"table1_csv/{library}",
+            "get_table1_split_reads.py",
+            [library],
+            [te_mapper_json, TARGETS_PATH],
+            [f"{te_mapper}/split_reads_for_tgt.csv"],
+        ),
+        # the set of figures depends on which targets are found, so the script
+        # lists the figures it rendered
+        Unit(
+            f"table1_diagrams/{library}",
+            "mk_table1_diagrams.py",
+            [library],
+            [te_mapper_json, TARGETS_PATH],
+            [f"{te_mapper}/figures.txt"],
+            output_list=f"{te_mapper}/figures.txt",
+        ),
+        Unit(
+            f"sx4et51_split_reads/{library}",
+            "get_sx4et51_split_reads.py",
+            [library],
+            [f"{te_mapper}/genome_aligned.store", TARGETS_PATH],
+            [f"{te_mapper}/sx4et51_reads.txt"],
+        ),
+        Unit(
+            f"genome_reads/{library}",
+            "get_genome_reads.py",
+            [library],
+            [f"{bwa_genome}/genome_aligned.store", TARGETS_PATH],
+            [f"{bwa_genome}/sx4et51_reads.txt"],
+        ),
+        Unit(
+            f"depth/{library}",
+            "depth.py",
+            [library],
+            [f"{bwa_genome}/genome_aligned.sam", TARGETS_PATH],
+            [f"{bwa_genome}/depth.csv"],
+        ),
+    ]
+    for tgt in sequence_table.targets:
+        rows_path = f"{te_mapper}/sequence_rows/{tgt.name}.csv"
+        extraction.append(
+            Unit(
+                f"sequence_rows/{library}/{tgt.name}",
+                "make_split_read_sequence_table.py",
+                ["--rows", f"{library}.fastq", tgt.name, rows_path],
+                [te_mapper_json, f"{te_mapper}/genome_aligned.store"],
+                [rows_path],
+                # only this target's entry of the registry, not the whole file
+                parameters=repr(tgt),
+            )
+        )
+
+    sx4et51 = [
+        Unit(
+            f"sx4et51_csv/{library}",
+            "mk_sx4et51_upstream_csv.py",
+            [library],
+            [f"{te_mapper}/sx4et51_reads.txt", TARGETS_PATH],
+            [f"{te_mapper}/sx4et51_reads.csv"],
+        ),
+        Unit(
+            f"sx4et51_diagrams/{library}",
+            "mk_sx4et51_upstream_diagrams.py",
+            [library],
+            [f"{te_mapper}/sx4et51_reads.txt", TARGETS_PATH],
+            [f"{te_mapper}/figure_sx4et51_upstream.png"],
+        ),
+    ]
+
+    return [stores, extraction, sx4et51]
+
+
+def sequence_rows_paths() -> List[str]:
+    """Rows of the split read sequence table for each (library, target), in table order."""
+    return [
+        f"output/te_mapper/{library}/sequence_rows/{tgt.name}.csv"
+        for library in LIBRARIES
+        for tgt in sequence_table.targets
+    ]
+
+
+def assemble_sequence_table():
+    """Concatenate the per-(library, target) rows into the split read sequence table."""
+    with open_table(
+        "output/te_mapper/split_read_sequence_table.csv", sequence_table.columns()
+    ) as table:
+        for rows_path in sequence_rows_paths():
+            with open(rows_path, "r") as in_file:
+                table.write_rows(line.rstrip("\n").split(",") for line in in_file)
+
+
+class Pipeline:
+    def __init__(self, manifest: Manifest, jobs: int, dry_run: bool):
+        self.manifest = manifest
+        self.jobs = jobs
+        self.dry_run = dry_run
+        self._source_hashes: Dict[str, str] = {}
+
+    def unit_hash(self, unit: Unit) -> str:
+        if unit.script not in self._source_hashes:
+            self._source_hashes[unit.script] = source_hash(unit.script)
+        digest = hashlib.sha256()
+        digest.update(unit.name.encode())
+        digest.update(unit.parameters.encode())
+        digest.update(self._source_hashes[unit.script].encode())
+        for path in unit.inputs:
+            digest.update(path.encode())
+            digest.update(self.manifest.file_hash(path).encode())
+        return digest.hexdigest()
+
+    def is_current(self, unit: Unit, unit_hash: str) -> bool:
+        return self.manifest.units.get(unit.name) == unit_hash and all(
+            os.path.exists(path) for path in unit.outputs + unit.listed_outputs()
+        )
+
+    def run_stage(self, units: List[Unit]):
+        """Run the out-of-date units of a stage (in parallel), updating the manifest."""
+        todo: List[Tuple[Unit, str]] = []
+        for unit in units:
+            missing = [path for path in unit.inputs if not os.path.exists(path)]
+            if missing:
+                print(f"skipping {unit.name}: missing {', '.join(missing)}")
+                continue
+            unit_hash = self.unit_hash(unit)
+            if not self.is_current(unit, unit_hash):
+                todo.append((unit, unit_hash))
+
+        for unit, _ in todo:
+            print(f"{'would run' if self.dry_run else 'running'} {unit.name}")
+        if self.dry_run:
+            return
+
+        for unit, _ in todo:
+            for path in unit.outputs:
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+        with ThreadPoolExecutor(max_workers=self.jobs) as pool:
+            futures = [
+                (unit, unit_hash, pool.submit(unit.run)) for unit, unit_hash in todo
+            ]
+            failed = []
+            for unit, unit_hash, future in futures:
+                try:
+                    future.result()
+                    self.manifest.units[unit.name] = unit_hash
+                except subprocess.CalledProcessError:
+                    failed.append(unit.name)
+        self.manifest.save()
+        if failed:
+            raise RuntimeError(f"failed units: {', '.join(failed)}")
+
+    def run(self, libraries: List[str]):
+        per_library = [library_units(library) for library in libraries]
+        for stage in zip(*per_library):
+            self.run_stage([unit for units in stage for unit in units])
+
+        # the table (always of all libraries) only changes if one of its parts changed
+        rows_paths = sequence_rows_paths()
+        missing = [path for path in rows_paths if not os.path.exists(path)]
+        if missing:
+            print(f"skipping split read sequence table: missing {', '.join(missing)}")
+            return
+        digest = hashlib.sha256()
+        for path in rows_paths:
+            digest.update(self.manifest.file_hash(path).encode())
+        table_hash = digest.hexdigest()
+        if self.manifest.units.get(
+            "sequence_table"
+        ) != table_hash or not os.path.exists(
+            "output/te_mapper/split_read_sequence_table.csv"
+        ):
+            print(f"{'would run' if self.dry_run else 'running'} sequence_table")
+            if not self.dry_run:
+                assemble_sequence_table()
+                self.manifest.units["sequence_table"] = table_hash
+                self.manifest.save()
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="run the out-of-date Python stages of the pipeline"
+    )
+    parser.add_argument(
+        "libraries",
+        nargs="*",
+        default=LIBRARIES,
+        help="libraries to process (default: all)",
+    )
+    parser.add_argument(
+        "-j", "--jobs", type=int, default=1, help="number of units to run in parallel"
+    )
+    parser.add_argument(
+        "-n",
+        "--dry-run",
+        action="store_true",
+        help="only print the units that are out of date",
+    )
+    parser.add_argument(
+        "--profile",
+        metavar="REPORT",
+        help="append the resource usage of each unit to a JSON lines report",
+    )
+    args = parser.parse_args()
+
+    if args.profile is not None:
+        # the scripts run by the units report to the same file
+        os.environ[REPORT_ENV] = args.profile
+    with stage("pipeline"):
+        Pipeline(Manifest(MANIFEST_PATH), args.jobs, args.dry_run).run(args.libraries)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,269 @@
+"""per-stage resource usage of the pipeline, as a JSON lines report
+
+Profiling is off unless the SX_PROFILE environment variable names a report
+file (e.g. `make SX_PROFILE=output/profile.jsonl` or `pipeline.py --profile`).
+Each stage then appends one JSON object to the report:
+
+    stage, library: what ran
+    start: when it started (seconds since the epoch)
+    wall_s, cpu_s: elapsed and CPU time (user + system, including children)
+    peak_rss_kb: peak resident memory of the process (or of the command)
+    records, records_per_s: records processed (e.g. SAM lines), if counted
+    bytes_read: bytes read by the process (/proc/self/io), or the size of the
+        inputs of an external command
+
+The Python scripts report themselves (profile_script); external commands such
+as sx map and bwa mem are wrapped by the run subcommand, and the pipeline
+driver wraps the scripts it runs.
+
+usage:
+    python3 scripts/profiling.py run --stage STAGE [--library LIB] [--input PATH ...] -- COMMAND ...
+    python3 scripts/profiling.py summary [REPORT]
+"""
+
+import argparse
+import atexit
+import json
+import os
+import resource
+import subprocess
+import sys
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional
+
+REPORT_ENV = "SX_PROFILE"
+
+
+def report_path() -> Optional[str]:
+    return os.environ.get(REPORT_ENV) or None
+
+
+def _bytes_read() -> Optional[int]:
+    """Bytes read by this process so far (Linux only)."""
+    try:
+        with open("/proc/self/io", "r") as in_file:
+            for line in in_file:
+                if line.startswith("rchar:"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return None
+
+
+def _cpu_time() -> float:
+    total = 0.0
+    for who in (resource.RUSAGE_SELF, resource.RUSAGE_CHILDREN):
+        usage = resource.getrusage(who)
+        total += usage.ru_utime + usage.ru_stime
+    return total
+
+
+def _peak_rss() -> int:
+    return max(
+        resource.getrusage(who).ru_maxrss
+        for who in (resource.RUSAGE_SELF, resource.RUSAGE_CHILDREN)
+    )
+
+
+def write_record(path: str, record: dict):
+    # a single short append, so concurrent stages do not interleave their lines
+    with open(path, "a") as out_file:
+        out_file.write(json.dumps(record) + "\n")
+
+
+class Stage:
+    """Counters of a running stage."""
+
+    def __init__(self, name: str, library: Optional[str]):
+        self.name = name
+        self.library = library
+        self.records = 0
+        self.start = time.time()
+        self._wall = time.perf_counter()
+        self._cpu = _cpu_time()
+        self._bytes = _bytes_read()
+
+    def add_records(self, records: int):
+        self.records += records
+
+    def record(self) -> dict:
+        wall = time.perf_counter() - self._wall
+        bytes_read = _bytes_read()
+        return {
+            "stage": self.name,
+            "library": self.library,
+            "start": round(self.start, 3),
+            "wall_s": round(wall, 3),
+            "cpu_s": round(_cpu_time() - self._cpu, 3),
+            "peak_rss_kb": _peak_rss(),
+            "records": self.records,
+            "records_per_s": round(self.records / wall, 1) if wall > 0 else None,
+            "bytes_read": (
+                bytes_read - self._bytes
+                if bytes_read is not None and self._bytes is not None
+                else None
+            ),
+        }
+
+
+# stages running in this process, innermost last
+_stages: List[Stage] = []
+
+
+@contextmanager
+def stage(name: str, library: Optional[str] = None) -> Iterator[Optional[Stage]]:
+    """Profile the body as a stage (a no-op yielding None if profiling is off)."""
+    path = report_path()
+    if path is None:
+        yield None
+        return
+    current = Stage(name, library)
+    _stages.append(current)
+    try:
+        yield current
+    finally:
+        _stages.remove(current)
+        write_record(path, current.record())
+
+
+def add_records(records: int):
+    """Count records processed towards the innermost running stage (if any)."""
+    if _stages:
+        _stages[-1].add_records(records)
+
+
+def profile_script(library: Optional[str] = None):
+    """Profile the rest of a script run as a stage named after the script."""
+    path = report_path()
+    if path is None:
+        return
+    current = Stage(os.path.splitext(os.path.basename(sys.argv[0]))[0], library)
+    _stages.append(current)
+    atexit.register(lambda: write_record(path, current.record()))
+
+
+def run_command(
+    name: str,
+    command: List[str],
+    library: Optional[str] = None,
+    inputs: Optional[List[str]] = None,
+) -> int:
+    """Run an external command, reporting its usage (if profiling is on); its exit code."""
+    path = report_path()
+    if path is None:
+        return subprocess.run(command).returncode
+    start = time.time()
+    wall = time.perf_counter()
+    process = subprocess.Popen(command)
+    # wait4 gives the resource usage of that command alone
+    _, status, usage = os.wait4(process.pid, 0)
+    process.returncode = os.waitstatus_to_exitcode(status)
+    wall = time.perf_counter() - wall
+    write_record(
+        path,
+        {
+            "stage": name,
+            "library": library,
+            "start": round(start, 3),
+            "wall_s": round(wall, 3),
+            "cpu_s": round(usage.ru_utime + usage.ru_stime, 3),
+            "peak_rss_kb": usage.ru_maxrss,
+            "records": 0,
+            "records_per_s": None,
+            "bytes_read": sum(
+                os.path.getsize(input_path)
+                for input_path in inputs or []
+                if os.path.exists(input_path)
+            ),
+            "command": command,
+            "exit_code": process.returncode,
+        },
+    )
+    return process.returncode
+
+
+def read_report(path: str) -> List[dict]:
+    with open(path, "r") as in_file:
+        return [json.loads(line) for line in in_file if line.strip()]
+
+
+def summarize(records: List[dict]) -> Dict[str, dict]:
+    """Totals per stage (over libraries and runs), in order of first appearance."""
+    totals: Dict[str, dict] = {}
+    for record in records:
+        total = totals.setdefault(
+            record["stage"],
+            {
+                "runs": 0,
+                "wall_s": 0.0,
+                "cpu_s": 0.0,
+                "peak_rss_kb": 0,
+                "records": 0,
+                "bytes_read": 0,
+            },
+        )
+        total["runs"] += 1
+        total["wall_s"] += record["wall_s"]
+        total["cpu_s"] += record["cpu_s"]
+        total["peak_rss_kb"] = max(total["peak_rss_kb"], record["peak_rss_kb"])
+        total["records"] += record["records"]
+        total["bytes_read"] += record["bytes_read"] or 0
+    return totals
+
+
+def print_summary(path: str):
+    totals = summarize(read_report(path))
+    print(
+        f"{'stage':<36}{'runs':>6}{'wall s':>10}{'cpu s':>10}{'peak MB':>10}"
+        f"{'records/s':>12}{'MB read':>10}"
+    )
+    for name, total in sorted(totals.items(), key=lambda item: -item[1]["wall_s"]):
+        rate = total["records"] / total["wall_s"] if total["wall_s"] else 0
+        print(
+            f"{name:<36}{total['runs']:>6}{total['wall_s']:>10.1f}"
+            f"{total['cpu_s']:>10.1f}{total['peak_rss_kb'] / 1024:>10.0f}"
+            f"{rate:>12.0f}{total['bytes_read'] / (1 << 20):>10.0f}"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="profile the stages of the pipeline")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = subparsers.add_parser(
+        "run", help=f"run a command as a stage (reported if ${REPORT_ENV} is set)"
+    )
+    run_parser.add_argument("--stage", required=True, help="stage name")
+    run_parser.add_argument("--library", help="library the command processes")
+    run_parser.add_argument(
+        "--input",
+        action="append",
+        default=[],
+        help="input file of the command (counted as bytes read)",
+    )
+    run_parser.add_argument("cmd", nargs=argparse.REMAINDER, help="-- COMMAND ...")
+
+    summary_parser = subparsers.add_parser("summary", help="totals per stage")
+    summary_parser.add_argument(
+        "report",
+        nargs="?",
+        default=report_path(),
+        help=f"report (default: ${REPORT_ENV})",
+    )
+    args = parser.parse_args()
+
+    if args.command == "summary":
+        if args.report is None:
+            parser.error(f"no report given and ${REPORT_ENV} is not set")
+        print_summary(args.report)
+        return
+
+    command = args.cmd[1:] if args.cmd[:1] == ["--"] else args.cmd
+    if not command:
+        parser.error("no command given")
+    sys.exit(run_command(args.stage, command, args.library, args.input))
+
+
+if __name__ == "__main__":
+    main()
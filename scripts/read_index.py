@@ -0,0 +1,296 @@
+"""hash-partitioned read name index of the alignments of a SAM file
+
+The index holds the alignment lines of a SAM file keyed by the name of their
+fragment (see pairs.fragment_name), so the te_mapper alignments of a split read
+("<name>|<TE>|<match>|<clip>") and the bwa alignments of the same read are
+found under the same name. The lines are hash-partitioned by name into
+PARTITIONS partitions, each sorted by name and packed into zlib-compressed
+blocks of about BLOCK_SIZE bytes. For each partition, the index records the
+first and last name, file offset and length of every block, so looking up a
+read only decompresses the block(s) holding its name.
+
+File layout:
+    MAGIC
+    compressed blocks, partition by partition
+    index (zlib-compressed JSON)
+    8-byte little-endian offset of the index
+
+usage:
+    python3 scripts/read_index.py build <in.sam> <out.names>
+    python3 scripts/read_index.py lookup <library> [--names FILE] [NAME ...]
+    python3 scripts/read_index.py check [--block-size BYTES] <in.sam>
+"""
+
+import argparse
+import bisect
+import json
+import os
+import struct
+import sys
+import tempfile
+import zlib
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from atomic import atomic_write
+from pairs import fragment_name
+from profiling import profile_script
+from sam import QNAME, read_sam_lines, split_fields
+
+MAGIC = b"SXRI\x01"
+
+# partitions of the index (each is sorted in memory during the build)
+PARTITIONS = 256
+
+# uncompressed size of a block (in bytes)
+BLOCK_SIZE = 1 << 16
+
+FOOTER = struct.Struct("<Q")
+
+# aligners whose genome alignments are indexed, in output/<aligner>/<library>
+ALIGNERS = ("te_mapper", "bwa_genome")
+
+
+def _name(line: str) -> str:
+    return fragment_name(split_fields(line, (QNAME,))[0])
+
+
+def _partition(name: str, partitions: int) -> int:
+    return zlib.crc32(name.encode()) % partitions
+
+
+def index_path(aligner: str, library: str) -> str:
+    return f"output/{aligner}/{library}/genome_aligned.names"
+
+
+def _write_partitions(sam_path: str, tmp_dir: str) -> List[str]:
+    """Split the alignment lines into one file per partition, in file order."""
+    paths = [os.path.join(tmp_dir, f"part_{i}.sam") for i in range(PARTITIONS)]
+    files = [open(path, "w") for path in paths]
+    try:
+        for line in read_sam_lines(sam_path):
+            files[_partition(_name(line), PARTITIONS)].write(line)
+    finally:
+        for part_file in files:
+            part_file.close()
+    return paths
+
+
+def build_index(sam_path: str, out_path: str, block_size: int = BLOCK_SIZE):
+    """Index the alignments of a SAM file by read name."""
+    # blocks of each partition: [first name, last name, offset, compressed length]
+    index: List[List[list]] = [[] for _ in range(PARTITIONS)]
+
+    with tempfile.TemporaryDirectory(
+        dir=os.path.dirname(os.path.abspath(out_path))
+    ) as tmp_dir, atomic_write(out_path, "wb") as out_file:
+        part_paths = _write_partitions(sam_path, tmp_dir)
+        out_file.write(MAGIC)
+
+        for blocks, part_path in zip(index, part_paths):
+            with open(part_path, "r") as part_file:
+                # stable, so the lines of a read stay in file order
+                lines = sorted(
+                    ((_name(line), line) for line in part_file),
+                    key=lambda item: item[0],
+                )
+            os.remove(part_path)
+
+            block: List[str] = []
+            size = 0
+            for i, (name, line) in enumerate(lines):
+                if not block:
+                    first = name
+                block.append(line)
+                size += len(line)
+                # the lines of a read can span blocks (lookups check the names)
+                if size >= block_size or i == len(lines) - 1:
+                    data = zlib.compress("".join(block).encode())
+                    blocks.append([first, name, out_file.tell(), len(data)])
+                    out_file.write(data)
+                    block.clear()
+                    size = 0
+
+        index_offset = out_file.tell()
+        out_file.write(
+            zlib.compress(
+                json.dumps({"partitions": PARTITIONS, "blocks": index}).encode()
+            )
+        )
+        out_file.write(FOOTER.pack(index_offset))
+
+
+class ReadIndex:
+    """Read-only access to an index written by build_index."""
+
+    def __init__(self, path: str):
+        self._file = open(path, "rb")
+        if self._file.read(len(MAGIC)) != MAGIC:
+            self._file.close()
+            raise ValueError(f"{path} is not a read name index")
+        self._file.seek(-FOOTER.size, os.SEEK_END)
+        footer_offset = self._file.tell()
+        (index_offset,) = FOOTER.unpack(self._file.read(FOOTER.size))
+        self._file.seek(index_offset)
+        index = json.loads(
+            zlib.decompress(self._file.read(footer_offset - index_offset))
+        )
+        self._partitions: int = index["partitions"]
+        self._blocks: List[List[list]] = index["blocks"]
+        # last name of each block, for binary search
+        self._block_ends = [[block[1] for block in blocks] for blocks in self._blocks]
+        # the last block read, by name (lookups of nearby names often share it)
+        self._cached: Optional[int] = None
+        self._cached_lines: Dict[str, List[str]] = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_):
+        self.close()
+
+    def close(self):
+        self._file.close()
+
+    def _block_lines(self, offset: int, length: int) -> Dict[str, List[str]]:
+        if self._cached != offset:
+            self._file.seek(offset)
+            lines: Dict[str, List[str]] = {}
+            data = zlib.decompress(self._file.read(length)).decode()
+            for line in data.splitlines(keepends=True):
+                lines.setdefault(_name(line), []).append(line)
+            self._cached = offset
+            self._cached_lines = lines
+        return self._cached_lines
+
+    def lookup(self, name: str) -> List[str]:
+        """The alignment lines of a read (by fragment name), in file order."""
+        name = fragment_name(name)
+        partition = _partition(name, self._partitions)
+        blocks = self._blocks[partition]
+        lines = []
+        start = bisect.bisect_left(self._block_ends[partition], name)
+        for first, _, offset, length in blocks[start:]:
+            if first > name:
+                break
+            lines.extend(self._block_lines(offset, length).get(name, []))
+        return lines
+
+    def lookup_many(self, names: Iterable[str]) -> Dict[str, List[str]]:
+        """The alignment lines of many reads (in the order given), block by block."""
+        names = list(dict.fromkeys(fragment_name(name) for name in names))
+        # in file order, so each block is decompressed once
+        found = {
+            name: self.lookup(name)
+            for name in sorted(
+                names, key=lambda name: (_partition(name, self._partitions), name)
+            )
+        }
+        return {name: found[name] for name in names}
+
+
+class ReadAlignments:
+    """The te_mapper and bwa_genome alignments of the reads of a library."""
+
+    def __init__(self, library: str):
+        self.library = library
+        self._indexes = [
+            ReadIndex(index_path(aligner, library)) for aligner in ALIGNERS
+        ]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_):
+        self.close()
+
+    def close(self):
+        for index in self._indexes:
+            index.close()
+
+    def lookup(self, names: Iterable[str]) -> Dict[str, Tuple[List[str], List[str]]]:
+        """(te_mapper lines, bwa_genome lines) of each read."""
+        names = list(names)
+        te_mapper, bwa_genome = (index.lookup_many(names) for index in self._indexes)
+        return {name: (te_mapper[name], bwa_genome[name]) for name in te_mapper}
+
+
+def check_index(sam_path: str, block_size: int = BLOCK_SIZE) -> int:
+    """Index a SAM file in a temporary directory and compare every lookup to a scan.
+
+    A small block size makes the lines of reads span blocks. The number of read
+    names whose lookup differs from the scan (0 if the index is right).
+    """
+    expected: Dict[str, List[str]] = {}
+    for line in read_sam_lines(sam_path):
+        expected.setdefault(_name(line), []).append(line)
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = os.path.join(tmp_dir, "check.names")
+        build_index(sam_path, path, block_size)
+        with ReadIndex(path) as index:
+            found = index.lookup_many(list(expected) + ["not a read"])
+    wrong = [name for name, lines in expected.items() if found[name] != lines]
+    wrong += ["not a read"] if found["not a read"] else []
+    for name in wrong[:10]:
+        print(f"lookup of {name} differs from the SAM file", file=sys.stderr)
+    return len(wrong)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="index alignments by read name, and look reads up"
+    )
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    build_parser = subparsers.add_parser("build", help="index a SAM file")
+    build_parser.add_argument("sam", help="SAM file (can be gzip compressed)")
+    build_parser.add_argument("out", help="index file to write")
+
+    lookup_parser = subparsers.add_parser(
+        "lookup",
+        help="print the te_mapper and bwa_genome alignments of reads of a library",
+    )
+    lookup_parser.add_argument("library", help="library (e.g. 7_R1_001)")
+    lookup_parser.add_argument("names", nargs="*", help="read names")
+    lookup_parser.add_argument(
+        "--names",
+        dest="names_file",
+        metavar="FILE",
+        help="file with one read name (or SAM line) per line",
+    )
+    check_parser = subparsers.add_parser(
+        "check", help="check the lookups of every read of a SAM file against a scan"
+    )
+    check_parser.add_argument("sam", help="SAM file (can be gzip compressed)")
+    check_parser.add_argument(
+        "--block-size",
+        type=int,
+        default=BLOCK_SIZE,
+        help="uncompressed block size (e.g. 256, so reads span blocks)",
+    )
+    args = parser.parse_args()
+
+    if args.command == "check":
+        wrong = check_index(args.sam, args.block_size)
+        print(f"{wrong} read names looked up wrong")
+        sys.exit(1 if wrong else 0)
+
+    if args.command == "build":
+        profile_script()
+        build_index(args.sam, args.out)
+        return
+
+    names = list(args.names)
+    if args.names_file is not None:
+        with open(args.names_file, "r") as in_file:
+            names.extend(_name(line) for line in in_file if line.strip())
+    if not names:
+        parser.error("no read names given")
+    with ReadAlignments(args.library) as alignments:
+        for name, lines in alignments.lookup(names).items():
+            for aligner, aligner_lines in zip(ALIGNERS, lines):
+                for line in aligner_lines:
+                    sys.stdout.write(f"{aligner}\t{line}")
+
+
+if __name__ == "__main__":
+    main()
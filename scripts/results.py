@@ -0,0 +1,264 @@
+"""te_mapper insertion calls, and an index for finding them by position"""
+
+import json
+import os
+import pickle
+from array import array
+from dataclasses import dataclass
+from typing import Iterator, List, Optional, Tuple
+
+from atomic import atomic_write
+from compressed import open_input, resolve
+from intervals import IntervalIndex
+from profiling import add_records
+
+
+@dataclass
+class SplitReadRanges:
+    te_range: List[int]
+    genome_range: List[int]
+
+
+# the four coordinates stored for every split read
+COLUMNS = ("te_start", "te_end", "genome_start", "genome_end")
+
+
+class SplitReads:
+    """Read ranges of the split reads on one side of a result, stored column-wise.
+
+    Each coordinate is kept in its own array, so a result with thousands of reads
+    holds four arrays rather than thousands of objects. Indexing and iteration
+    still give SplitReadRanges objects, which are built on the fly.
+    """
+
+    __slots__ = COLUMNS
+
+    def __init__(
+        self,
+        te_start: Optional[array] = None,
+        te_end: Optional[array] = None,
+        genome_start: Optional[array] = None,
+        genome_end: Optional[array] = None,
+    ):
+        self.te_start = te_start if te_start is not None else array("q")
+        self.te_end = te_end if te_end is not None else array("q")
+        self.genome_start = genome_start if genome_start is not None else array("q")
+        self.genome_end = genome_end if genome_end is not None else array("q")
+
+    @classmethod
+    def from_json(cls, raw: List[dict]) -> "SplitReads":
+        """Build from the te_mapper JSON representation (a list of range pairs)."""
+        reads = cls()
+        for read in raw:
+            reads.te_start.append(read["te_range"][0])
+            reads.te_end.append(read["te_range"][1])
+            reads.genome_start.append(read["genome_range"][0])
+            reads.genome_end.append(read["genome_range"][1])
+        return reads
+
+    def __len__(self) -> int:
+        return len(self.te_start)
+
+    def __getitem__(self, i: int) -> SplitReadRanges:
+        return SplitReadRanges(
+            [self.te_start[i], self.te_end[i]],
+            [self.genome_start[i], self.genome_end[i]],
+        )
+
+    def __iter__(self) -> Iterator[SplitReadRanges]:
+        for i in range(len(self)):
+            yield self[i]
+
+    def __eq__(self, other) -> bool:
+        if not isinstance(other, SplitReads):
+            return NotImplemented
+        return all(getattr(self, col) == getattr(other, col) for col in COLUMNS)
+
+    def __repr__(self) -> str:
+        return f"SplitReads({list(self)})"
+
+    def rows(self) -> Iterator[Tuple[int, int, int, int]]:
+        """(te_start, te_end, genome_start, genome_end) for every read."""
+        return zip(self.te_start, self.te_end, self.genome_start, self.genome_end)
+
+    def sort_by(self, column: str, reverse: bool = False):
+        """Sort the reads in place by one of the columns (stable, like list.sort)."""
+        key = getattr(self, column)
+        order = sorted(range(len(self)), key=key.__getitem__, reverse=reverse)
+        for col in COLUMNS:
+            values = getattr(self, col)
+            setattr(self, col, array("q", [values[i] for i in order]))
+
+
+@dataclass
+class Result:
+    ref: bool
+    name: str
+    chrom: str
+    upstream_pos: int
+    downstream_pos: int
+    orientation: str
+    upstream_reads: SplitReads
+    downstream_reads: SplitReads
+
+
+# bump whenever the pickled representation of the results changes
+CACHE_VERSION = 2
+
+
+def _parse_results(path: str) -> List[Result]:
+    with open_input(path, "r") as in_file:
+        raw = json.load(in_file)
+    results = []
+    for chrom in raw:
+        for result in chrom["non_reference"]:
+            results.append(Result(False, **result))
+        for result in chrom["reference"]:
+            results.append(Result(True, **result))
+    for result in results:
+        result.upstream_reads = SplitReads.from_json(result.upstream_reads)
+        result.downstream_reads = SplitReads.from_json(result.downstream_reads)
+    return results
+
+
+def _pack_results(results: List[Result]) -> Tuple[List[tuple], List[array]]:
+    """Flatten results into one tuple per result and one array per read range column."""
+    rows = []
+    columns = [array("q") for _ in COLUMNS]
+    for result in results:
+        rows.append(
+            (
+                result.ref,
+                result.name,
+                result.chrom,
+                result.upstream_pos,
+                result.downstream_pos,
+                result.orientation,
+                len(result.upstream_reads),
+                len(result.downstream_reads),
+            )
+        )
+        for reads in (result.upstream_reads, result.downstream_reads):
+            for column, col in zip(columns, COLUMNS):
+                column.extend(getattr(reads, col))
+    return rows, columns
+
+
+def _unpack_results(rows: List[tuple], columns: List[array]) -> List[Result]:
+    """Inverse of _pack_results."""
+    results = []
+    i = 0
+    for (
+        ref,
+        name,
+        chrom,
+        upstream_pos,
+        downstream_pos,
+        orientation,
+        n_up,
+        n_down,
+    ) in rows:
+        upstream_reads = SplitReads(*(column[i : i + n_up] for column in columns))
+        i += n_up
+        downstream_reads = SplitReads(*(column[i : i + n_down] for column in columns))
+        i += n_down
+        results.append(
+            Result(
+                ref,
+                name,
+                chrom,
+                upstream_pos,
+                downstream_pos,
+                orientation,
+                upstream_reads,
+                downstream_reads,
+            )
+        )
+    return results
+
+
+def load_results(path: str, use_cache: bool = True) -> List[Result]:
+    """Load all (non-reference and reference) results from a te_mapper_output.json file.
+
+    The parsed results are cached in a compact binary form next to the JSON file
+    (<path>.cache): one tuple per result plus one array per read range column.
+    The cache is keyed on the path, modification time and size of the JSON file,
+    so it is rebuilt automatically whenever the JSON file changes. The JSON file
+    can be compressed (or only exist as <path>.gz).
+    """
+    path = resolve(path)
+    stat = os.stat(path)
+    key = (CACHE_VERSION, os.path.abspath(path), stat.st_mtime_ns, stat.st_size)
+    cache_path = f"{path}.cache"
+
+    if use_cache:
+        try:
+            with open(cache_path, "rb") as cache_file:
+                # the key is pickled separately, so a stale cache is not fully loaded
+                if pickle.load(cache_file) == key:
+                    results = _unpack_results(*pickle.load(cache_file))
+                    add_records(len(results))
+                    return results
+        except (OSError, EOFError, pickle.UnpicklingError, ValueError):
+            # missing, unreadable or outdated cache: parse the JSON file instead
+            pass
+
+    results = _parse_results(path)
+    add_records(len(results))
+
+    if use_cache:
+        try:
+            # concurrent readers never see a partial cache, and a failed write
+            # (e.g. a full disk) leaves no temporary file behind
+            with atomic_write(cache_path, "wb") as cache_file:
+                pickle.dump(key, cache_file, pickle.HIGHEST_PROTOCOL)
+                pickle.dump(_pack_results(results), cache_file, pickle.HIGHEST_PROTOCOL)
+        except OSError:
+            # caching is best-effort (e.g. the output folder may be read-only)
+            pass
+
+    return results
+
+
+def te_family(te_name: str) -> str:
+    """TE family of a TE name (e.g. "1360#DNA/P" -> "1360")"""
+    return te_name.split("#")[0]
+
+
+class ResultIndex:
+    """Results indexed by chromosome and TE family.
+
+    Reference results are stored as the span of the reference TE, and
+    non-reference results as their upstream and downstream positions, so a
+    lookup costs O(log n) instead of a scan over every result.
+    """
+
+    def __init__(self, results: List[Result]):
+        self._ref: IntervalIndex[Tuple[int, Result]] = IntervalIndex()
+        self._non_ref: IntervalIndex[Tuple[int, Result]] = IntervalIndex()
+        for i, result in enumerate(results):
+            key = (result.chrom, te_family(result.name))
+            if result.ref:
+                # an empty span can never contain a position
+                if result.downstream_pos >= result.upstream_pos:
+                    self._ref.add(
+                        key, result.upstream_pos, result.downstream_pos, (i, result)
+                    )
+            else:
+                for pos in {result.upstream_pos, result.downstream_pos}:
+                    self._non_ref.add(key, pos, pos, (i, result))
+
+    def near(self, te_name: str, chrom: str, pos: int, cutoff: int) -> List[Result]:
+        """Results that are candidates for an insertion of the TE family at chrom:pos.
+
+        A reference result is a candidate if its span contains pos, and a
+        non-reference result if its upstream or downstream position is within
+        cutoff of pos. Results are returned in their original order.
+        """
+        key = (chrom, te_family(te_name))
+        found = self._ref.containing(key, pos) + self._non_ref.overlapping(
+            key, pos - cutoff, pos + cutoff
+        )
+        # a non-reference result can be found through both of its positions
+        unique = {i: result for i, result in found}
+        return [unique[i] for i in sorted(unique)]
@@ -0,0 +1,61 @@
+"""streaming access to SAM alignment files
+
+Records are read one line at a time through a fixed-size buffer, so memory use
+does not depend on the size of the SAM file. The SAM file can be gzip or BGZF
+compressed (or only exist as <path>.gz).
+"""
+
+from typing import Iterator, List, Sequence
+
+from compressed import open_input
+from profiling import add_records
+
+# SAM column indices
+QNAME = 0
+FLAG = 1
+RNAME = 2
+POS = 3
+MAPQ = 4
+CIGAR = 5
+RNEXT = 6
+PNEXT = 7
+TLEN = 8
+SEQ = 9
+QUAL = 10
+
+# size of the read buffer (in bytes)
+BUFFER_SIZE = 1 << 20
+
+
+def read_sam_lines(path: str, buffer_size: int = BUFFER_SIZE) -> Iterator[str]:
+    """Yield the alignment lines (header lines skipped, trailing newline included)."""
+    records = 0
+    try:
+        with open_input(path, "r", buffer_size) as in_file:
+            for line in in_file:
+                # header lines all start with "@", which is not allowed in a QNAME
+                if line.startswith("@"):
+                    continue
+                records += 1
+                # the last line of a file can lack its newline
+                if not line.endswith("\n"):
+                    line += "\n"
+                yield line
+    finally:
+        # counted once at the end, to keep the per-line loop tight
+        add_records(records)
+
+
+def split_fields(line: str, columns: Sequence[int]) -> List[str]:
+    """Split out only the requested columns of an alignment line, in the requested order."""
+    # stop splitting after the last column we care about
+    fields = line.rstrip("\n").split("\t", max(columns) + 1)
+    return [fields[column] for column in columns]
+
+
+def read_sam(
+    path: str, columns: Sequence[int], buffer_size: int = BUFFER_SIZE
+) -> Iterator[List[str]]:
+    """Yield the requested columns of every alignment record in a SAM file."""
+    for line in read_sam_lines(path, buffer_size):
+        yield split_fields(line, columns)
@@ -0,0 +1,178 @@
+"""streaming output of tables, as CSV or Parquet
+
+Rows are written as they are produced, so a table never has to be held in
+memory. CSV rows are collected into large chunks and each chunk is written in
+one call, instead of a few small writes per row. The CSV is the same as the
+scripts have always written: fields joined by commas, without quoting.
+
+A table whose path ends in .parquet is written as Parquet instead, one row
+group at a time (column types are taken from the values of the first row
+group). This needs pyarrow, which is only imported then.
+
+usage:
+    with open_table("table.csv", ["Name", "Reads"]) as table:
+        table.write(["SX4Et51", 12])
+"""
+
+from typing import Iterable, List, Optional, Sequence
+
+# characters of CSV buffered before a write, and rows per Parquet row group
+BUFFER_SIZE = 1 << 20
+ROW_GROUP_SIZE = 1 << 16
+
+# layout of the split read tables of targets (split_reads_for_tgt.csv and
+# sx4et51_reads.csv): a row per target, then a row per read with the ranges of
+# its upstream and downstream reads in the last 8 columns
+SPLIT_READS_TABLE_COLUMNS = [
+    "Name",
+    "TE Name",
+    "Chromosome",
+    "Upstream Position",
+    "Downstream Position",
+    "Orientation",
+    "Reference?",
+    "Upstream Reads (TE Range)",
+    "",
+    "Upstream Reads (Genome Range)",
+    "",
+    "Downstream Reads (TE Range)",
+    "",
+    "Downstream Reads (Genome Range)",
+    "",
+]
+
+
+class CsvTable:
+    """CSV table written through a large buffer."""
+
+    def __init__(
+        self,
+        path: str,
+        columns: Optional[List[str]] = None,
+        buffer_size: int = BUFFER_SIZE,
+    ):
+        self._file = open(path, "w")
+        self._buffer: List[str] = []
+        self._buffered = 0
+        self._buffer_size = buffer_size
+        if columns is not None:
+            self._append(",".join(columns) + "\n")
+
+    def _append(self, text: str):
+        self._buffer.append(text)
+        self._buffered += len(text)
+        if self._buffered >= self._buffer_size:
+            self.flush()
+
+    def write(self, row: Sequence):
+        self._append(",".join(map(str, row)) + "\n")
+
+    def write_rows(self, rows: Iterable[Sequence]):
+        for row in rows:
+            self.write(row)
+
+    def flush(self):
+        self._file.write("".join(self._buffer))
+        self._buffer = []
+        self._buffered = 0
+
+    def close(self):
+        if not self._file.closed:
+            self.flush()
+            self._file.close()
+
+    def __enter__(self) -> "CsvTable":
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def parquet_names(columns: List[str]) -> List[str]:
+    """Column names that are valid in Parquet (not empty, and unique).
+
+    The CSV tables leave the second column of a range unnamed, so an unnamed
+    column gets the name of the column before it, with its position.
+    """
+    names: List[str] = []
+    for i, column in enumerate(columns):
+        name = column or (f"{names[-1]} {i}" if names else f"Column {i}")
+        while name in names:
+            name = f"{name} {i}"
+        names.append(name)
+    return names
+
+
+class ParquetTable:
+    """Parquet table written one row group at a time."""
+
+    def __init__(
+        self, path: str, columns: List[str], row_group_size: int = ROW_GROUP_SIZE
+    ):
+        try:
+            import pyarrow
+            import pyarrow.parquet
+        except ImportError as error:
+            raise ImportError(
+                f"writing {path} needs pyarrow (pip install pyarrow)"
+            ) from error
+        self._pa = pyarrow
+        self._pq = pyarrow.parquet
+        self.path = path
+        self.names = parquet_names(columns)
+        self._columns: List[list] = [[] for _ in self.names]
+        self._row_group_size = row_group_size
+        self._writer = None
+
+    def write(self, row: Sequence):
+        if len(row) != len(self.names):
+            raise ValueError(f"{self.path}: expected {len(self.names)} fields: {row}")
+        for column, value in zip(self._columns, row):
+            column.append(value)
+        if len(self._columns[0]) >= self._row_group_size:
+            self.flush()
+
+    def write_rows(self, rows: Iterable[Sequence]):
+        for row in rows:
+            self.write(row)
+
+    def flush(self):
+        if not self._columns[0] and self._writer is not None:
+            return
+        if self._writer is None:
+            table = self._pa.table(dict(zip(self.names, self._columns)))
+            if not self._columns[0]:
+                # no rows at all: the columns are strings
+                table = table.cast(
+                    self._pa.schema([(name, self._pa.string()) for name in self.names])
+                )
+            self._writer = self._pq.ParquetWriter(self.path, table.schema)
+        else:
+            table = self._pa.table(
+                dict(zip(self.names, self._columns)), schema=self._writer.schema
+            )
+        self._writer.write_table(table)
+        self._columns = [[] for _ in self.names]
+
+    def close(self):
+        if self._columns is not None:
+            self.flush()
+            self._writer.close()
+            self._columns = None
+
+    def __enter__(self) -> "ParquetTable":
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def open_table(path: str, columns: List[str], header: bool = True):
+    """Open a table for writing, as Parquet if the path ends in .parquet (else CSV).
+
+    Without header, a CSV table starts straight with the rows (Parquet tables
+    always have their column names).
+    """
+    if path.endswith(".parquet"):
+        return ParquetTable(path, columns)
+    return CsvTable(path, columns if header else None)
@@ -0,0 +1,102 @@
+"""registry of SX-4 insertion targets, loaded from targets.csv
+
+Columns of targets.csv:
+    name: insertion line name (e.g. SX4Et51)
+    te_name: full name of the natural TE the insertion is in (e.g. copia#LTR/Copia)
+    chrom, pos: insertion site (confirmed through inverse PCR)
+    te_length: length of the natural TE, for figures (optional)
+    call_pos: upstream position of the matching te_mapper call, for figures (optional)
+    cutoff: bp on each side of pos to search, overriding the script default (optional)
+    groups: ";"-separated groups the target belongs to (e.g. table1;figures)
+"""
+
+import csv
+import os
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from intervals import IntervalIndex
+
+REGISTRY_PATH = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "targets.csv"
+)
+
+
+@dataclass(frozen=True)
+class Target:
+    name: str
+    te_name: str
+    chrom: str
+    pos: int
+    te_length: Optional[int] = None
+    call_pos: Optional[int] = None
+    cutoff: Optional[int] = None
+    groups: Tuple[str, ...] = ()
+
+    def window(self, default_cutoff: int) -> int:
+        """Number of bp on each side of the insertion to search."""
+        return self.cutoff if self.cutoff is not None else default_cutoff
+
+
+def _optional_int(value: Optional[str]) -> Optional[int]:
+    return int(value) if value else None
+
+
+class TargetRegistry:
+    """Targets in registry order, with lookups by name, group and position."""
+
+    def __init__(self, targets: List[Target]):
+        self._targets = targets
+        self._by_name: Dict[str, Target] = {}
+        for target in targets:
+            if target.name in self._by_name:
+                raise ValueError(f"duplicate target name: {target.name}")
+            self._by_name[target.name] = target
+        self._indices: Dict[int, IntervalIndex[Target]] = {}
+
+    def __iter__(self) -> Iterator[Target]:
+        return iter(self._targets)
+
+    def __len__(self) -> int:
+        return len(self._targets)
+
+    def get(self, name: str) -> Target:
+        return self._by_name[name]
+
+    def group(self, group: str) -> "TargetRegistry":
+        """Targets that belong to a group, in registry order."""
+        return TargetRegistry([target for target in self if group in target.groups])
+
+    def index(self, default_cutoff: int) -> IntervalIndex[Target]:
+        """Window around each target, keyed by chromosome (built once per cutoff)."""
+        if default_cutoff not in self._indices:
+            index: IntervalIndex[Target] = IntervalIndex()
+            for target in self:
+                window = target.window(default_cutoff)
+                index.add(
+                    target.chrom, target.pos - window, target.pos + window, target
+                )
+            self._indices[default_cutoff] = index
+        return self._indices[default_cutoff]
+
+
+@lru_cache(maxsize=None)
+def load_targets(path: str = REGISTRY_PATH) -> TargetRegistry:
+    """Load (once per process) the target registry."""
+    targets = []
+    with open(path, "r", newline="") as in_file:
+        for row in csv.DictReader(in_file):
+            targets.append(
+                Target(
+                    row["name"],
+                    row["te_name"],
+                    row["chrom"],
+                    int(row["pos"]),
+                    _optional_int(row.get("te_length")),
+                    _optional_int(row.get("call_pos")),
+                    _optional_int(row.get("cutoff")),
+                    tuple(filter(None, (row.get("groups") or "").split(";"))),
+                )
+            )
+    return TargetRegistry(targets)
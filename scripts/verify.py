@@ -0,0 +1,168 @@
+"""verification of split reads by aligning their TE part to the TE consensus
+
+te_mapper encodes the TE a read matched in its name, but the split read
+sequence table only checks that the match and clip lengths line up. Here the TE
+part of each read is aligned to the consensus of that TE (on either strand):
+
+1. seeding: the k-mers of the TE part are looked up in an index of the
+   consensus, and the diagonal (consensus position - read position) with the
+   most hits is chosen, on the strand with the most hits
+2. alignment: a banded local (Smith-Waterman) alignment around that diagonal,
+   computed for a whole batch of reads at once with numpy
+
+The score of a read is its best local alignment score divided by the score of
+a perfect match of the whole TE part, so 1.0 means an exact match.
+"""
+
+from collections import Counter, defaultdict
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from fasta import FastaFile
+
+# seed length, and number of diagonals on each side of the seed diagonal
+K = 11
+BAND = 8
+
+# linear gap scoring
+MATCH = 2
+MISMATCH = -3
+GAP = -5
+
+# reads with a score of at least this are verified
+MIN_SCORE = 0.8
+
+# reads aligned at once
+BATCH_SIZE = 1 << 12
+
+# A, C, G, T; anything else (e.g. N) never matches
+CODES = np.full(256, 4, dtype=np.uint8)
+for code, base in enumerate(b"ACGT"):
+    CODES[base] = CODES[base + 32] = code
+# value of the positions past the end of a read / consensus
+PAD = 5
+
+COMPLEMENT = str.maketrans("ACGTacgt", "TGCAtgca")
+
+
+def encode(seq: str) -> np.ndarray:
+    return CODES[np.frombuffer(seq.encode(), dtype=np.uint8)]
+
+
+def reverse_complement(seq: str) -> str:
+    return seq.translate(COMPLEMENT)[::-1]
+
+
+class Consensus:
+    """A TE consensus sequence with an index of its k-mers."""
+
+    def __init__(self, seq: str):
+        self.seq = seq.upper()
+        self.encoded = encode(self.seq)
+        self.kmers: Dict[str, List[int]] = defaultdict(list)
+        for pos in range(len(self.seq) - K + 1):
+            self.kmers[self.seq[pos : pos + K]].append(pos)
+
+    def seed(self, part: str) -> Optional[Tuple[int, bool]]:
+        """(diagonal, reverse strand?) with the most k-mer hits (None if no hits)."""
+        best = None
+        best_hits = 0
+        for reverse, query in ((False, part), (True, reverse_complement(part))):
+            diagonals = Counter(
+                pos - offset
+                for offset in range(len(query) - K + 1)
+                for pos in self.kmers.get(query[offset : offset + K], ())
+            )
+            if diagonals:
+                diagonal, hits = diagonals.most_common(1)[0]
+                if hits > best_hits:
+                    best, best_hits = (diagonal, reverse), hits
+        return best
+
+    def window(self, diagonal: int, length: int) -> np.ndarray:
+        """Consensus bases around a diagonal for a query of a given length (padded)."""
+        start = diagonal - BAND
+        end = diagonal + length + BAND
+        window = np.full(end - start, PAD, dtype=np.uint8)
+        lo, hi = max(start, 0), min(end, len(self.encoded))
+        if lo < hi:
+            window[lo - start : hi - start] = self.encoded[lo:hi]
+        return window
+
+
+def align_batch(queries: np.ndarray, refs: np.ndarray) -> np.ndarray:
+    """Best banded local alignment score of each query against its reference window.
+
+    queries is (reads, length) and refs is (reads, length + 2 * BAND): row i of a
+    query is aligned to columns i..i + 2 * BAND of its window (the band), so the
+    seed diagonal is in the middle of the band.
+    """
+    reads, length = queries.shape
+    width = 2 * BAND + 1
+    # horizontal gaps along a row are a running maximum:
+    # h[k] = max over j <= k of h0[j] + GAP * (k - j)
+    gap_steps = GAP * np.arange(width, dtype=np.int32)
+    previous = np.zeros((reads, width), dtype=np.int32)
+    best = np.zeros(reads, dtype=np.int32)
+    vertical = np.empty((reads, width), dtype=np.int32)
+    vertical[:, -1] = np.iinfo(np.int32).min // 2
+    for i in range(length):
+        query = queries[:, i : i + 1]
+        band = refs[:, i : i + width]
+        scores = np.where((band == query) & (query < 4), MATCH, MISMATCH)
+        # diagonal predecessors are at the same band offset in the previous row,
+        # vertical ones at the next offset
+        vertical[:, :-1] = previous[:, 1:] + GAP
+        current = np.maximum(np.maximum(previous + scores, vertical), 0)
+        current = np.maximum.accumulate(current - gap_steps, axis=1) + gap_steps
+        best = np.maximum(best, current.max(axis=1))
+        previous = current
+    return best
+
+
+class Verifier:
+    """Scores split reads against the consensus sequences of a FASTA file."""
+
+    def __init__(self, fasta_path: str):
+        self._fasta = FastaFile(fasta_path)
+        self._consensus: Dict[str, Optional[Consensus]] = {}
+
+    def consensus(self, te_name: str) -> Optional[Consensus]:
+        if te_name not in self._consensus:
+            self._consensus[te_name] = (
+                Consensus(self._fasta.fetch(te_name, 1, self._fasta.length(te_name)))
+                if te_name in self._fasta
+                else None
+            )
+        return self._consensus[te_name]
+
+    def scores(self, reads: Sequence[Tuple[str, str]]) -> np.ndarray:
+        """Score of each (TE name, TE part of the read); 0 for unknown TEs or no seed."""
+        scores = np.zeros(len(reads))
+        seeded = []
+        for i, (te_name, part) in enumerate(reads):
+            consensus = self.consensus(te_name)
+            if consensus is None or not part:
+                continue
+            seed = consensus.seed(part)
+            if seed is not None:
+                diagonal, reverse = seed
+                query = reverse_complement(part) if reverse else part
+                seeded.append((i, encode(query), consensus.window(diagonal, len(part))))
+
+        for start in range(0, len(seeded), BATCH_SIZE):
+            batch = seeded[start : start + BATCH_SIZE]
+            length = max(len(query) for _, query, _ in batch)
+            queries = np.full((len(batch), length), PAD, dtype=np.uint8)
+            refs = np.full((len(batch), length + 2 * BAND), PAD, dtype=np.uint8)
+            for row, (_, query, window) in enumerate(batch):
+                queries[row, : len(query)] = query
+                refs[row, : len(window)] = window
+            best = align_batch(queries, refs)
+            for row, (i, query, _) in enumerate(batch):
+                scores[i] = best[row] / (MATCH * len(query))
+        return scores
+
+    def close(self):
+        self._fasta.close()